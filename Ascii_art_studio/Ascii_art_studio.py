@@ -1,9 +1,7 @@
 from PIL import Image, ImageEnhance;
 import json;
 
-ASCII_CHARS = "@%#*+=-:. ";  # Från mörkt till ljus
-DEFAULT_WIDTH = 50;           # Standardbredd (krav)
-STRETCH = 0.5;                # Höjdkorrigering för monospace
+from constants import ASCII_CHARS, DEFAULT_WIDTH, STRETCH;
 
 
 class AsciiArtImage:
@@ -0,0 +1,181 @@
+import os;
+import re;
+import sys;
+import time;
+from PIL import Image, ImageSequence;
+import charsets;
+from constants import FRAME_SEPARATOR, PLAY_FPS;
+
+def _require_ascii(art):
+    '''
+    Bildrutor renderas bara i läget ascii; de andra lägena läser art:s egen
+    avkodade bild och kan inte matas med en ruta i taget. Hellre ett fel än
+    att tyst ge vanlig ASCII för en bild som står i t.ex. läget color.
+    '''
+    if art.mode != "ascii":
+        raise ValueError(f"Bildrutor kan bara renderas i läget ascii, inte {art.mode} (set <img> mode ascii)");
+
+def _frame_mapper(art):
+    '''
+    Returnera en funktion som gör om en Pillow-bild till rader (UTF-8-bytes)
+    med art:s inställningar. Målstorlek, ljus/kontrast-tabell och teckentabell
+    räknas fram en gång och återanvänds för alla rutor. Ljus/kontrast läggs
+    alltid på efter resize (som pipeline "fused"), med kontrastens medelvärde
+    från art:s egen bild. Bara filhuvudet behövs: tabellen räknas ur
+    histogrammet utan att bilden avkodas (se AsciiArtImage._tone_table).
+    '''
+    if art.orig_size is None:
+        raise RuntimeError("Ingen bild laddad");
+    _require_ascii(art);
+    if not art.height or art.height <= 0:
+        art._calc_height_from_width();
+    size = (art.width, art.height);
+    tone = art._tone_table() if art.brightness != 1.0 or art.contrast != 1.0 else None;
+    charset = charsets.get(art.chars);
+    w = art.width;
+
+    def to_rows(frame):
+        img = art._view_resized(frame.convert("L"), size);
+        if tone:
+            img = img.point(tone);
+        img = art._dithered(img);
+        return list(charset.rows(img.tobytes(), w));
+
+    return to_rows;
+
+def source_frames(art):
+    '''Generera bildrutorna i art:s fil (en ruta för vanliga bilder).'''
+    with Image.open(art.filename) as src:
+        for frame in ImageSequence.Iterator(src):
+            yield frame;
+
+def numbered_images(directory):
+    '''Sökvägar till bildfilerna i en katalog, sorterade på numret i filnamnet.'''
+    def order(name):
+        nums = re.findall(r"\d+", name);
+        return (int(nums[-1]) if nums else -1, name);
+    names = [n for n in os.listdir(directory)
+             if n.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"))];
+    return [os.path.join(directory, n) for n in sorted(names, key=order)];
+
+def dir_frames(paths):
+    '''
+    Generera bildrutor från en lista filer. Filerna öppnas bara (filhuvudet
+    läses); pixlarna avkodas först när rutan används, så en ruta som play
+    hoppar över kostar ingen avkodning. Filen stängs när nästa ruta hämtas.
+    '''
+    for path in paths:
+        with Image.open(path) as img:
+            yield img;
+
+def iter_frames(art):
+    '''
+    Generera ASCII-konsten för varje bildruta i art:s fil (t.ex. animerad GIF),
+    en ruta i taget som en lista med rader. Bara en ruta åt gången finns i
+    minnet, oavsett hur många rutor filen har.
+    '''
+    to_rows = _frame_mapper(art);
+    for frame in source_frames(art):
+        yield [row.decode("utf-8") for row in to_rows(frame)];
+
+def write_frames(art, target, split=False):
+    '''
+    Rendera alla bildrutor till fil.
+    :param target: fil för samlad utdata, eller katalog om split=True
+    :param split: en textfil per ruta (frame_00001.txt ...) istället för en fil
+                  där rutorna skiljs åt av en rad med FRAME_SEPARATOR
+    :return: dict med antal rutor, tid och rutor per sekund
+    :raises ValueError: om art inte står i läget ascii
+    '''
+    # innan målfilen eller katalogen skapas, iter_frames kontrollerar först vid första rutan
+    _require_ascii(art);
+    start = time.perf_counter();
+    frames = 0;
+    if split:
+        os.makedirs(target, exist_ok=True);
+        for frames, lines in enumerate(iter_frames(art), 1):
+            with open(os.path.join(target, f"frame_{frames:05d}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n");
+    else:
+        with open(target, "w", encoding="utf-8") as f:
+            for frames, lines in enumerate(iter_frames(art), 1):
+                if frames > 1:
+                    f.write(FRAME_SEPARATOR + "\n");
+                f.write("\n".join(lines) + "\n");
+    elapsed = max(time.perf_counter() - start, 1e-9);
+    return {"frames": frames, "seconds": elapsed, "fps": frames / elapsed};
+
+def diff_rows(prev, rows):
+    '''
+    Bygg ANSI-utdata som ritar om bara det som ändrats sedan förra rutan:
+    för varje ändrad rad flyttas markören till första ändrade kolumnen och
+    bara spannet fram till sista ändrade tecknet skrivs.
+    Raderna jämförs som heltal med XOR, så ingen Python-loop per tecken behövs.
+    '''
+    out = [];
+    for r, row in enumerate(rows):
+        old = prev[r] if prev is not None and r < len(prev) else None;
+        if old == row:
+            continue;
+        # spannen räknas i byte, så rader med flerbytetecken skrivs om hela
+        if old is None or len(old) != len(row) or not row.isascii():
+            out.append(b"\x1b[%d;1H" % (r + 1) + row);
+            continue;
+        x = int.from_bytes(old, "big") ^ int.from_bytes(row, "big");
+        first = len(row) - (x.bit_length() + 7) // 8;
+        last = len(row) - 1 - ((x & -x).bit_length() - 1) // 8;
+        out.append(b"\x1b[%d;%dH" % (r + 1, first + 1) + row[first:last + 1]);
+    return b"".join(out);
+
+def play(art, frames=None, fps=PLAY_FPS, out=None, clock=time.monotonic, sleep=time.sleep):
+    '''
+    Spela upp bildrutor i terminalen i fps rutor per sekund.
+    Varje ruta har en tidpunkt i schemat; ligger vi efter så att nästa rutas
+    tidpunkt redan passerat hoppas rutan över utan att renderas. Bara ändrade
+    rader/spann skickas (se diff_rows). Ctrl-C avbryter uppspelningen.
+
+    :param frames: Pillow-bilder att spela, None = rutorna i art:s egen fil
+    :param out: binär ström, None = sys.stdout.buffer
+    :return: dict med visade/tappade rutor, faktisk fps och byte per sekund
+    :raises ValueError: om art inte står i läget ascii
+    '''
+    out = out if out is not None else sys.stdout.buffer;
+    frames = frames if frames is not None else source_frames(art);
+    to_rows = _frame_mapper(art);
+    period = 1.0 / fps;
+    shown = dropped = sent = 0;
+    prev = None;
+    # rensa skärmen och göm markören under uppspelningen
+    out.write(b"\x1b[2J\x1b[?25l");
+    start = clock();
+    try:
+        for i, frame in enumerate(frames):
+            now = clock();
+            due = start + i * period;
+            if now > due + period:
+                dropped += 1;
+                continue;
+            if now < due:
+                sleep(due - now);
+            rows = to_rows(frame);
+            data = diff_rows(prev, rows);
+            out.write(data);
+            out.flush();
+            sent += len(data);
+            prev = rows;
+            shown += 1;
+    except KeyboardInterrupt:
+        pass;
+    finally:
+        # visa markören igen och ställ den under bilden
+        out.write(b"\x1b[%d;1H\x1b[?25h" % ((len(prev) if prev else 0) + 1));
+        out.flush();
+    elapsed = max(clock() - start, 1e-9);
+    return {
+        "shown": shown,
+        "dropped": dropped,
+        "seconds": elapsed,
+        "fps": shown / elapsed,
+        "bytes": sent,
+        "bytes_per_s": sent / elapsed
+    };
@@ -1,34 +1,186 @@
+import copy;
+import itertools;
+import math;
+import time;
 from PIL import Image, ImageEnhance;
-from constants import ASCII_CHARS, DEFAULT_WIDTH, STRETCH;
+from constants import (CELL_SAMPLES, COLOR_LEVELS, DECODE_OVERSAMPLE, DITHERS, DEFAULT_WIDTH, PIPELINES, PYRAMID_MIN_SIZE,
+                       RENDER_MODES, STRETCH);
+import charsets;
+import dithering;
+import rendermodes;
+import sharded;
+import tiled;
+from rendercache import RenderCache;
+from stats import STATS;
+
+# Löpnummer som identifierar en inläsning av en bild i render-cachen
+_TOKENS = itertools.count();
 
 class AsciiArtImage:
     '''Hanterar en bilds metadata och kan generera ASCII‑konst av den.'''
 
-    def __init__(self, filename, alias=None):
-        '''Initiera med filnamn och ev. alias, sätter startvärden.'''
+    def __init__(self, filename, alias=None, cache=None):
+        '''
+        Initiera med filnamn och ev. alias, sätter startvärden.
+        :param cache: delad RenderCache (t.ex. sessionens), annars skapas en egen
+        '''
         self.filename = filename;
         self.alias = alias;
         self.image = None;
+        self.rgb = None;
         self.orig_size = None;
         self.width = DEFAULT_WIDTH;
         self.height = None;
         self.brightness = 1.0;
         self.contrast = 1.0;
+        self.pipeline = "classic";
+        self.mode = "ascii";
+        self.charset = "standard";
+        self.chars = charsets.CHARSETS["standard"];
+        self.dither = "none";
+        self.zoom = 1.0;
+        self.center = (0.5, 0.5);
+        self.tiled = False;
+        self.shards = 1;
+        self.reduced_decode = False;
+        self._histogram = None;
+        self._levels = None;
+        self.cache = cache if cache is not None else RenderCache();
+        self.disk_cache = None;
+        self.pixel_cache = None;
+        self.glyph_cache = None;
+        self._token = next(_TOKENS);
 
-    def load(self):
-        '''Läs in bilden från disk, konvertera till gråskala och beräkna höjd.'''
+    def load(self, reduced=None):
+        '''
+        Läs in bilden från disk, konvertera till gråskala och beräkna höjd.
+        :param reduced: True = avkoda bara så många pixlar som nuvarande
+                        bredd/höjd behöver (JPEG draft eller Image.reduce)
+        '''
+        if reduced is not None:
+            self.reduced_decode = bool(reduced);
         try:
             with Image.open(self.filename) as img:
-                self.image = img.convert("L");
-                # sparar originalstorleken så att proportionerna kan beräknas vid resize
-                self.orig_size = self.image.size;
+                self._read_header(img);
+                self._decode(img);
         except Exception as e:
             raise FileNotFoundError(f"Kunde inte ladda bild '{self.filename}': {e}");
+
+    def load_header(self, reduced=None):
+        '''
+        Läs bara storleken ur filhuvudet och beräkna höjd.
+        Pixlarna avkodas först vid första renderingen.
+        '''
+        if reduced is not None:
+            self.reduced_decode = bool(reduced);
+        try:
+            try:
+                img = Image.open(self.filename);
+            except Image.DecompressionBombError:
+                # filhuvudet är ofarligt; gränsen gäller igen när pixlarna avkodas
+                # (rendering i remsor avkodar aldrig hela bilden)
+                img = tiled.open_unchecked(self.filename);
+            with img:
+                self._read_header(img);
+        except Exception as e:
+            raise FileNotFoundError(f"Kunde inte ladda bild '{self.filename}': {e}");
+        self.unload();
+
+    def _read_header(self, img):
+        '''Spara originalstorleken från en öppnad (ännu ej avkodad) bild.'''
+        # sparar originalstorleken så att proportionerna kan beräknas vid resize
+        self.orig_size = img.size;
+        # filen kan ha ändrats sedan sist, så gamla renderingar gäller inte längre
+        self.cache.invalidate(self._token);
+        self._token = next(_TOKENS);
         if self.width is None:
             self.width = DEFAULT_WIDTH;
         #ser till att höjden alltid matchar bredden med bibehållen aspect ratio och STRETCH
         self._calc_height_from_width();
 
+    def unload(self):
+        '''Släpp avkodade pixlar (och pyramid); de läses in igen vid behov.'''
+        self.image = None;
+        self.rgb = None;
+        self._histogram = None;
+        self._levels = None;
+
+    def _decode_limit(self):
+        '''Minsta arbetsupplösning (pixlar) som nuvarande målstorlek och zoom behöver.'''
+        w, h = self._view_need(self._sample_size());
+        return (w * DECODE_OVERSAMPLE, h * DECODE_OVERSAMPLE);
+
+    def _sample_size(self):
+        '''
+        Antal bildpunkter renderingen använder: ett per tecken, utom i lägen
+        som half och braille där varje tecken visar flera (CELL_SAMPLES).
+        '''
+        cw, ch = CELL_SAMPLES.get(self.mode, (1, 1));
+        return (self.width * cw, self.height * ch);
+
+    def _decode(self, img, color=None):
+        '''
+        Avkoda pixlarna i en öppnad bild till gråskala och spara som arbetskopia.
+        I reducerat läge låter vi JPEG-avkodaren skala ner direkt (DCT-skalning)
+        och krymper andra format med reduce(), aldrig under _decode_limit().
+        Med pixel_cache hämtas redan avkodade pixlar minnesmappade från disk.
+        :param color: avkoda även en RGB-kopia (standard: om mode är "color")
+        '''
+        limit = self._decode_limit() if self.reduced_decode else None;
+        color = self.mode == "color" if color is None else color;
+        variant = [limit, color];
+        gray = rgb = None;
+        if self.pixel_cache is not None:
+            gray = self.pixel_cache.load(self.filename, variant, "L");
+            rgb = self.pixel_cache.load(self.filename, variant, "RGB") if color else None;
+        if gray is None or (color and rgb is None):
+            with STATS.time("decode"):
+                if limit and img.format == "JPEG":
+                    img.draft("RGB" if color else "L", limit);
+                gray = img.convert("L");
+                # färgläget behöver en RGB-kopia vid sidan av gråskalan
+                rgb = img.convert("RGB") if color else None;
+                if limit:
+                    factor = min(gray.width // limit[0], gray.height // limit[1]);
+                    if factor >= 2:
+                        gray = gray.reduce(factor);
+                        rgb = rgb.reduce(factor) if rgb else None;
+            if self.pixel_cache is not None:
+                self.pixel_cache.store(self.filename, variant, gray);
+                if rgb:
+                    self.pixel_cache.store(self.filename, variant, rgb);
+        # nya pixlar gör histogram och pyramid ogiltiga
+        self.unload();
+        self.image = gray;
+        self.rgb = rgb;
+
+    def _redecode(self, color=None):
+        '''Öppna filen igen och avkoda pixlarna (filhuvudet är redan läst).'''
+        try:
+            with Image.open(self.filename) as img:
+                self._decode(img, color);
+        except Exception as e:
+            raise FileNotFoundError(f"Kunde inte ladda bild '{self.filename}': {e}");
+
+    def _ensure_loaded(self, color=None):
+        '''
+        Se till att det finns pixlar i rätt upplösning: avkoda vid första
+        renderingen, och avkoda om när målstorleken vuxit förbi en reducerad kopia.
+        :param color: kräv även RGB-kopian (standard: om mode är "color"); låter
+            en delad bild förbereda pixlar åt kopior (derive) i färgläget
+        '''
+        if self.orig_size is None:
+            raise RuntimeError("Ingen bild laddad");
+        color = self.mode == "color" if color is None else color;
+        if self.image is None or (color and self.rgb is None):
+            self._redecode(color);
+            return;
+        if not self.reduced_decode or self.image.size == self.orig_size:
+            return;
+        need = self._decode_limit();
+        if self.image.width < need[0] or self.image.height < need[1]:
+            self._redecode(color);
+
     def _aspect(self):
         '''Returnera höjd/bredd-förhållandet för originalet.'''
         if not self.orig_size or self.orig_size[0] == 0:
@@ -46,6 +198,15 @@ class AsciiArtImage:
         denom = ar * STRETCH if ar * STRETCH != 0 else 1.0;
         self.width = max(1, int(round(self.height / denom)));
 
+    def derive(self):
+        '''
+        Returnera en kopia med egna inställningar som delar avkodade pixlar,
+        pyramid och cache-token med originalet. Ändringar i kopian påverkar
+        inte originalet, och renderingar hamnar i samma render-cache
+        eftersom inställningarna ingår i nyckeln.
+        '''
+        return copy.copy(self);
+
     def set_width(self, w):
         '''
         Sätt ny bredd och räkna om höjd.
@@ -92,38 +253,433 @@ class AsciiArtImage:
             raise ValueError("Contrast måste vara ett positivt tal");
         self.contrast = c;
 
-    def _enhanced_resized(self):
-        '''Returnera kopia av bilden med ljus/kontrast-justering och rätt storlek.'''
-        if not self.image:
-            raise RuntimeError("Ingen bild laddad");
-        if not self.height or self.height <= 0:
-            self._calc_height_from_width();
-        img = self.image;
+    def set_pipeline(self, p):
+        '''Välj ordning för ljus/kontrast: classic (före resize) eller fused (efter).'''
+        p = str(p).lower();
+        if p not in PIPELINES:
+            raise ValueError(f"Pipeline måste vara en av: {', '.join(PIPELINES)}");
+        self.pipeline = p;
+
+    def set_mode(self, m):
+        '''Välj renderingsläge, t.ex. ascii, color, half eller braille (se RENDER_MODES).'''
+        m = str(m).lower();
+        if m not in RENDER_MODES:
+            raise ValueError(f"Mode måste vara en av: {', '.join(RENDER_MODES)}");
+        self.mode = m;
+
+    def set_viewport(self, zoom=None, center=None):
+        '''
+        Visa bara en del av bilden: zoom >= 1 gånger förstoring runt center
+        (x, y) i andelar 0..1 av bilden. Den synliga delen har samma
+        proportioner som hela bilden, så width/height räknas som vanligt.
+        Centrum flyttas in så att utsnittet alltid ligger inom bilden.
+        '''
+        try:
+            z = float(self.zoom if zoom is None else zoom);
+            # NaN och oändligt klarar jämförelsen men ger inget utsnitt
+            if not math.isfinite(z) or z < 1.0:
+                raise ValueError;
+        except Exception:
+            raise ValueError("Zoom måste vara ett ändligt tal >= 1");
+        try:
+            cx, cy = self.center if center is None else (float(center[0]), float(center[1]));
+            if not (math.isfinite(cx) and math.isfinite(cy)):
+                raise ValueError;
+        except Exception:
+            raise ValueError("Centrum måste vara två ändliga tal");
+        half = 0.5 / z;
+        self.zoom = z;
+        self.center = (min(max(cx, half), 1.0 - half), min(max(cy, half), 1.0 - half));
+
+    def pan(self, dx, dy):
+        '''Flytta utsnittet dx, dy i andelar av den synliga delens bredd/höjd (1 = en hel skärm).'''
+        try:
+            dx, dy = float(dx), float(dy);
+            if not (math.isfinite(dx) and math.isfinite(dy)):
+                raise ValueError;
+        except Exception:
+            raise ValueError("Förflyttningen måste vara två ändliga tal");
+        cx, cy = self.center;
+        self.set_viewport(center=(cx + dx / self.zoom, cy + dy / self.zoom));
+
+    def reset_viewport(self):
+        '''Visa hela bilden igen.'''
+        self.zoom = 1.0;
+        self.center = (0.5, 0.5);
+
+    def _view_box(self, size=None):
+        '''
+        Det synliga utsnittet som box (x0, y0, x1, y1) i en bild med storleken
+        size (standard: originalet), eller None när hela bilden visas.
+        '''
+        if self.zoom == 1.0:
+            return None;
+        w, h = size or self.orig_size;
+        cx, cy = self.center;
+        half = 0.5 / self.zoom;
+        return ((cx - half) * w, (cy - half) * h, (cx + half) * w, (cy + half) * h);
+
+    def _view_need(self, size):
+        '''Hur stor hela bilden måste vara för att utsnittet ska få size pixlar.'''
+        return (int(math.ceil(size[0] * self.zoom)), int(math.ceil(size[1] * self.zoom)));
+
+    def _view_crop(self, img, size):
+        '''
+        Klipp ut utsnittet ur img (hela bilden i någon upplösning) inför en
+        resize till size: bara utsnittet plus några pixlar för filtret, så
+        kostnaden beror på utsnittets storlek och inte på hela bilden.
+        :return: (delbild, box för resize relativt delbilden)
+        '''
+        bx0, by0, bx1, by1 = self._view_box(img.size);
+        mx = int(math.ceil((bx1 - bx0) / size[0])) + 1;
+        my = int(math.ceil((by1 - by0) / size[1])) + 1;
+        x0, y0 = max(0, int(bx0) - mx), max(0, int(by0) - my);
+        x1, y1 = min(img.width, int(math.ceil(bx1)) + mx), min(img.height, int(math.ceil(by1)) + my);
+        return img.crop((x0, y0, x1, y1)), (bx0 - x0, by0 - y0, bx1 - x0, by1 - y0);
+
+    def _view_resized(self, img, size):
+        '''Skala det synliga utsnittet av img till size (hela img när zoom = 1).'''
+        if self.zoom == 1.0:
+            return img.resize(size, resample=Image.BILINEAR);
+        region, box = self._view_crop(img, size);
+        return region.resize(size, resample=Image.BILINEAR, box=box);
+
+    def set_charset(self, spec):
+        '''
+        Välj teckenuppsättning: ett namn i charsets.CHARSETS (t.ex. standard,
+        detailed, blocks) eller tecknen själva, som då rangordnas efter bläck.
+        '''
+        self.chars = charsets.resolve(str(spec));
+        self.charset = str(spec);
+
+    def set_dither(self, d):
+        '''
+        Välj dithering före teckenmappningen (se DITHERS och dithering.py):
+        none, ordered (Bayer) eller fs (Floyd–Steinberg).
+        '''
+        d = str(d).lower();
+        if d not in DITHERS:
+            raise ValueError(f"Dither måste vara en av: {', '.join(DITHERS)}");
+        self.dither = d;
+
+    def _dithered(self, img, levels=None, y0=0):
+        '''Dithra en färdigskalad gråskalebild till teckenuppsättningens nivåer (eller levels).'''
+        if self.dither == "none":
+            return img;
+        with STATS.time("dither"):
+            return dithering.apply(img, levels or len(self.chars) - 1, self.dither, y0);
+
+    def set_tiled(self, on):
+        '''
+        Slå på/av rendering i remsor (tiled.py): källan läses i horisontella
+        remsor och hela bilden avkodas aldrig, för mycket stora bilder.
+        Gäller ascii-läget; ljus/kontrast läggs på som i pipeline "fused".
+        '''
+        if isinstance(on, str):
+            if on.lower() not in ("on", "off"):
+                raise ValueError("Tiled måste vara on eller off");
+            on = on.lower() == "on";
+        self.tiled = bool(on);
+
+    def set_shards(self, n):
+        '''
+        Dela upp renderingen i n radband som körs i var sin process
+        (sharded.py). Resultatet blir detsamma som med en process, så
+        inställningen ingår inte i cache-nycklarna. 1 = ingen uppdelning.
+        Med dither fs renderas bilden ändå i en process, eftersom felet
+        sprids över hela bilden.
+        '''
+        try:
+            n = int(n);
+            if n < 1:
+                raise ValueError;
+        except Exception:
+            raise ValueError("Shards måste vara ett positivt heltal");
+        self.shards = n;
+
+    def _use_shards(self):
+        '''Sant om renderingen ska delas upp i radband över flera processer.'''
+        return self.shards > 1 and self.dither != "fs";
+
+    def _shard_count(self):
+        '''
+        Antal band renderingen faktiskt delas i (1 = en process), för
+        cache-nycklarna. Med zoom kan bandgränserna ge enstaka gråsteg
+        skillnad, så uppdelningen får inte dela cachepost med en vanlig rendering.
+        '''
+        return self.shards if self._use_shards() and not self._use_tiled() else 1;
+
+    def _use_tiled(self):
+        '''Sant om renderingen ska gå via remsor istället för hela bilden.'''
+        return self.tiled and self.mode == "ascii";
+
+    def _tone_table(self, source=None):
+        '''
+        Slå ihop Brightness och Contrast till en 256-tabell för Image.point.
+        Tabellen räknas fram genom att köra samma Pillow-operationer på en
+        gråskala 0..255, så avrundningen blir exakt som i ImageEnhance.
+        Contrast blandar mot medelvärdet av den ljusjusterade originalbilden;
+        det tas fram ur originalets histogram istället för en ny stor bild.
+        Är pixlarna inte avkodade räknas histogrammet i remsor ur filen
+        (tiled.histogram), så tabellen kräver ingen full avkodning.
+        :param source: bild (t.ex. en pyramidnivå) vars medelvärde ska användas,
+            som när ImageEnhance körs direkt på den; standard är originalet
+        '''
+        ramp = Image.frombytes("L", (256, 1), bytes(range(256)));
         if self.brightness != 1.0:
-            img = ImageEnhance.Brightness(img).enhance(self.brightness);
+            ramp = ImageEnhance.Brightness(ramp).enhance(self.brightness);
         if self.contrast != 1.0:
-            img = ImageEnhance.Contrast(img).enhance(self.contrast);
-        return img.resize((self.width, self.height), resample=Image.BILINEAR);
+            if source is not None and source is not self.image:
+                hist = source.histogram();
+            else:
+                if self._histogram is None:
+                    self._histogram = (self.image.histogram() if self.image is not None
+                                       else tiled.histogram(self.filename, self._decode_limit()));
+                hist = self._histogram;
+            lum = ramp.tobytes();
+            total = sum(hist) or 1;
+            mean = sum(n * lum[p] for p, n in enumerate(hist)) / total;
+            flat = Image.new("L", ramp.size, int(mean + 0.5));
+            ramp = Image.blend(flat, ramp, self.contrast);
+        return list(ramp.tobytes());
+
+    def _pyramid(self):
+        '''
+        Returnera listan med pyramidnivåer: originalet följt av kopior i
+        1/2, 1/4, 1/8 ... storlek. Byggs vid första renderingen och återanvänds
+        sedan för alla bredder, så en ny bredd kostar bara en liten resize.
+        '''
+        if self._levels is None:
+            with STATS.time("pyramid"):
+                levels = [self.image];
+                while min(levels[-1].size) // 2 >= PYRAMID_MIN_SIZE:
+                    levels.append(levels[-1].reduce(2));
+            self._levels = levels;
+        return self._levels;
+
+    def _source_for(self, size):
+        '''
+        Minsta pyramidnivå som är minst DECODE_OVERSAMPLE gånger size.
+        Nivåerna är box-filtrerade (reduce), så en nivå nära målstorleken
+        ger inte samma bild som en bilinjär resize från full upplösning;
+        med marginalen hamnar skillnaden på några enstaka gråsteg.
+        '''
+        need = (size[0] * DECODE_OVERSAMPLE, size[1] * DECODE_OVERSAMPLE);
+        for level in reversed(self._pyramid()):
+            if level.width >= need[0] and level.height >= need[1]:
+                return level;
+        return self.image;
+
+    def _pyramid_bytes(self):
+        '''Minne (byte) för de förminskade nivåerna, originalet oräknat.'''
+        if not self._levels:
+            return 0;
+        return sum(len(lv.getbands()) * lv.width * lv.height for lv in self._levels[1:]);
+
+    def _enhanced_resized(self, size=None):
+        '''
+        Returnera kopia av bilden med ljus/kontrast-justering och rätt storlek
+        (width x height, eller size om den anges).
+        Båda lägena utgår från minsta pyramidnivå som är minst målstorleken.
+
+        I läget "fused" görs resize först och ljus/kontrast sedan som en enda
+        tabell på den lilla bilden. Vid samma storlek blir resultatet identiskt
+        med "classic", men efter nedskalning skiljer det sig något: tabellen
+        klipper vid 0/255 och avrundar nedåt, och det ger inte samma sak före
+        som efter bilinjär interpolation. I mjuka partier handlar det om 0-1
+        gråsteg, men vid skarpa kanter där ljus/kontrast mättar ena sidan kan
+        enskilda pixlar skilja flera tiotal steg (medelfelet ligger kring 1).
+        '''
+        if not self.height or self.height <= 0:
+            self._calc_height_from_width();
+        self._ensure_loaded();
+        size = size or (self.width, self.height);
+        img = self._source_for(self._view_need(size));
+        if self.zoom != 1.0:
+            return self._enhanced_view(img, size);
+        if self.pipeline == "fused":
+            with STATS.time("resize"):
+                img = img.resize(size, resample=Image.BILINEAR);
+            if self.brightness != 1.0 or self.contrast != 1.0:
+                with STATS.time("enhance"):
+                    img = img.point(self._tone_table());
+            return img;
+        if self.brightness != 1.0 or self.contrast != 1.0:
+            with STATS.time("enhance"):
+                if self.brightness != 1.0:
+                    img = ImageEnhance.Brightness(img).enhance(self.brightness);
+                if self.contrast != 1.0:
+                    img = ImageEnhance.Contrast(img).enhance(self.contrast);
+        with STATS.time("resize"):
+            return img.resize(size, resample=Image.BILINEAR);
+
+    def _enhanced_view(self, img, size):
+        '''
+        Som _enhanced_resized men för ett utsnitt (zoom > 1). Ljus/kontrast
+        görs med tontabellen, före resize i "classic" och efter i "fused",
+        så att bara utsnittet behöver justeras; kontrastens medelvärde gäller
+        fortfarande hela bilden (i "classic" hela pyramidnivån, som utan zoom).
+        '''
+        tone = self._tone_table(img if self.pipeline == "classic" else None) \
+            if self.brightness != 1.0 or self.contrast != 1.0 else None;
+        if tone and self.pipeline == "classic":
+            with STATS.time("enhance"):
+                region, box = self._view_crop(img, size);
+                region = region.point(tone);
+            with STATS.time("resize"):
+                return region.resize(size, resample=Image.BILINEAR, box=box);
+        with STATS.time("resize"):
+            out = self._view_resized(img, size);
+        if tone:
+            with STATS.time("enhance"):
+                out = out.point(tone);
+        return out;
+
+    def _render_key(self):
+        '''
+        Nyckel för render-cachen. Setters behöver inte tömma cachen:
+        ändrade inställningar ger helt enkelt en ny nyckel.
+        '''
+        return (self._token, self.width, self.height, self.brightness, self.contrast, self.chars,
+                self.pipeline, self.mode, self.dither, self.tiled, self._shard_count(), self.zoom, self.center);
 
     def render_to_string(self):
-        '''Konvertera bilden till ASCII-konst som sträng.'''
-        img = self._enhanced_resized();
-        pixels = img.getdata();
-        n = len(ASCII_CHARS) - 1;
-        chars = [ASCII_CHARS[(p * n) // 255] for p in pixels];
-        lines = [''.join(chars[i:i + self.width]) for i in range(0, len(chars), self.width)];
-        return '\n'.join(lines);
+        '''Konvertera bilden till ASCII-konst som sträng (cachas per inställningar).'''
+        key = self._render_key();
+        art = self.cache.get(key);
+        if art is None:
+            art = self._render_via_disk() if self.disk_cache is not None else self._render();
+            self.cache.put(key, art);
+        return art;
+
+    def _disk_params(self):
+        '''Inställningar som påverkar utdata, som nyckel i disk-cachen.'''
+        return [self.width, self.height, self.brightness, self.contrast, self.chars,
+                self.pipeline, self.mode, COLOR_LEVELS, self.reduced_decode, self.dither, self.tiled,
+                self._shard_count(), self.zoom, list(self.center)];
+
+    def _render_via_disk(self):
+        '''Hämta renderingen från disk-cachen, eller rendera och spara den där.'''
+        key = self.disk_cache.key(self.filename, self._disk_params());
+        art = self.disk_cache.get(key);
+        if art is None:
+            art = self._render();
+            self.disk_cache.put(key, art);
+        return art;
+
+    def _render(self):
+        '''Kör hela kedjan ljus/kontrast, resize och teckenmappning.'''
+        if self.mode != "ascii":
+            return "\n".join(self.iter_lines());
+        if self._use_tiled() or self._use_shards():
+            return b'\n'.join(self._ascii_rows()).decode("utf-8");
+        img = self._dithered(self._enhanced_resized());
+        with STATS.time("map"):
+            return charsets.get(self.chars).text(img.tobytes(), self.width);
+
+    def iter_lines(self):
+        '''
+        Generera ASCII-konsten rad för rad, utan att bygga hela strängen.
+        Bara den förminskade bilden och en rad i taget hålls i minnet.
+        '''
+        if self.mode != "ascii":
+            yield from rendermodes.MODE_LINES[self.mode](self);
+            return;
+        for row in self._iter_row_bytes():
+            yield row.decode("utf-8");
+
+    def _iter_row_bytes(self):
+        '''Som iter_lines men ger varje rad som UTF-8-bytes.'''
+        if self.mode != "ascii":
+            for line in self.iter_lines():
+                yield line.encode("utf-8");
+            return;
+        yield from self._ascii_rows();
+
+    def _ascii_rows(self):
+        '''Generera teckenraderna (UTF-8-bytes, ASCII med standarduppsättningen) från gråskalan, utan färg.'''
+        if self._use_tiled():
+            if not self.height or self.height <= 0:
+                self._calc_height_from_width();
+            yield from tiled.iter_tiled_rows(self);
+            return;
+        if self._use_shards():
+            yield from sharded.iter_sharded_rows(self, self.shards);
+            return;
+        img = self._dithered(self._enhanced_resized());
+        data = img.tobytes();
+        charset = charsets.get(self.chars);
+        w = self.width;
+        # mappningen mäts rad för rad och rapporteras som en enda mätning
+        timing = STATS.enabled;
+        spent = 0.0;
+        for i in range(0, len(data), w):
+            if timing:
+                t0 = time.perf_counter();
+            row = charset.row(data[i:i + w]);
+            if timing:
+                spent += time.perf_counter() - t0;
+            yield row;
+        if timing:
+            STATS.record("map", spent);
+
+    def write_to(self, stream):
+        '''
+        Skriv konsten till en binär ström, en rad i taget med radslut efter
+        varje rad. Finns renderingen redan i cachen skrivs den direkt, och
+        med disk-cache påslagen går renderingen via den. En strömmad
+        rendering som ryms under cachetaket läggs i cachen efteråt.
+        :return: antal tecken som skrevs (utan radslut och ANSI-färgkoder)
+        '''
+        key = self._render_key();
+        art = self.cache.get(key);
+        if art is None and self.disk_cache is not None:
+            art = self._render_via_disk();
+            self.cache.put(key, art);
+        if art is not None:
+            stream.write(art.encode("utf-8") + b"\n");
+            return rendermodes.visible_len(art);
+        # raderna sparas medan de skrivs så att resultatet kan cachas; blir
+        # utdata större än cachetaket strömmas resten utan att sparas
+        count = 0;
+        size = 0;
+        rows = [];
+        for row in self._iter_row_bytes():
+            stream.write(row);
+            stream.write(b"\n");
+            text = row.decode("utf-8");
+            count += rendermodes.visible_len(text);
+            if rows is not None:
+                rows.append(text);
+                size += len(row);
+                if size > self.cache.max_bytes:
+                    rows = None;
+        if rows is not None:
+            self.cache.put(key, "\n".join(rows));
+        return count;
 
     def info_string(self):
         '''Returnera en rad text med bildens inställningar och metadata.'''
         size_str = f"{self.orig_size}" if self.orig_size else "(okänd)";
+        if self._levels is None:
+            pyr_str = "(ej byggd)";
+        else:
+            pyr_str = f"{len(self._levels) - 1} nivåer, {self._pyramid_bytes() // 1024} kB";
         return (
             f"{self.alias if self.alias else self.filename} "
             f"filename: {self.filename} "
             f"size: {size_str} "
             f"target size: ({self.width}, {self.height}) "
             f"brightness: {self.brightness} "
-            f"contrast: {self.contrast}"
+            f"contrast: {self.contrast} "
+            f"pipeline: {self.pipeline} "
+            f"mode: {self.mode} "
+            f"charset: {self.charset} "
+            f"dither: {self.dither} "
+            f"tiled: {'on' if self.tiled else 'off'} "
+            f"shards: {self.shards} "
+            f"view: zoom {self.zoom:g} @ ({self.center[0]:.3f}, {self.center[1]:.3f}) "
+            f"pyramid: {pyr_str}"
         );
 
     def to_dict(self):
@@ -134,16 +690,37 @@ class AsciiArtImage:
             "width": self.width,
             "height": self.height,
             "brightness": self.brightness,
-            "contrast": self.contrast
+            "contrast": self.contrast,
+            "pipeline": self.pipeline,
+            "mode": self.mode,
+            "charset": self.charset,
+            "dither": self.dither,
+            "tiled": self.tiled,
+            "shards": self.shards,
+            "zoom": self.zoom,
+            "center": list(self.center)
         };
 
     @staticmethod
-    def from_dict(d):
-        '''Skapa AsciiArtImage från sparad metadata och ladda bilden.'''
-        img = AsciiArtImage(d["filename"], d.get("alias"));
+    def from_dict(d, cache=None, reduced=None, lazy=False):
+        '''
+        Skapa AsciiArtImage från sparad metadata och ladda bilden.
+        :param lazy: läs bara filhuvudet, pixlarna avkodas vid första renderingen
+        '''
+        img = AsciiArtImage(d["filename"], d.get("alias"), cache);
         img.width = int(d.get("width", DEFAULT_WIDTH));
         img.height = int(d["height"]) if d.get("height") else None;
         img.brightness = float(d.get("brightness", 1.0));
         img.contrast = float(d.get("contrast", 1.0));
-        img.load();
+        img.set_pipeline(d.get("pipeline", "classic"));
+        img.set_mode(d.get("mode", "ascii"));
+        img.set_charset(d.get("charset", "standard"));
+        img.set_dither(d.get("dither", "none"));
+        img.set_tiled(d.get("tiled", False));
+        img.set_shards(d.get("shards", 1));
+        img.set_viewport(d.get("zoom", 1.0), d.get("center", (0.5, 0.5)));
+        if lazy:
+            img.load_header(reduced);
+        else:
+            img.load(reduced);
         return img;
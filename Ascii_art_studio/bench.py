@@ -0,0 +1,308 @@
+'''
+Benchmark för renderingskedjan: load, ljus/kontrast + resize och
+teckenmappning, på syntetiska bilder i flera storlekar och bredder.
+
+Tider mäts utan tracemalloc (som gör Pythons allokeringar mycket
+långsammare). Minnet mäts i ett separat varv per steg: py_peak_bytes är
+Pythons högsta allokering enligt tracemalloc och rss_peak_kb hur mycket
+processens RSS som mest växte under steget, vilket även räknar Pillows
+bildbuffertar i C (tracemalloc ser dem inte). rss_peak_kb kräver Linux (/proc/self/clear_refs)
+och är annars null.
+
+Skriver maskinläsbar JSON. Med --baseline jämförs körningen mot en sparad
+JSON-fil och steg som blivit mer än --threshold långsammare flaggas
+(exit-kod 1).
+
+    python bench.py --output base.json
+    python bench.py --baseline base.json --threshold 0.2
+    python bench.py --suite shard     # skalning med antal processer
+    python bench.py --suite dither    # kostnad per megapixel för dithering
+
+Mål för dithering inklusive teckenmappning (ms per megapixel gråskala, en
+kärna), se DITHER_TARGETS: ordered under 20 ms/MP och fs under 40 ms/MP,
+mot under 10 ms/MP för rak kvantisering (none). Uppmätt på utvecklarens
+maskin, 640x480 till 8000x6000: none 2-4, ordered 5-11 och fs 26-31 ms/MP.
+Ditheringen körs på utdatastorleken, som i batchjobb oftast är långt under
+en megapixel, så den ska inte märkas där. Mätpunkter som går över målet
+får within_target = false.
+'''
+import argparse;
+import ctypes;
+import ctypes.util;
+import json;
+import os;
+import platform;
+import re;
+import sys;
+import tempfile;
+import time;
+import tracemalloc;
+import PIL;
+from PIL import Image;
+from asciiartimage import AsciiArtImage;
+import charsets;
+import dithering;
+from rendercache import RenderCache;
+
+try:
+    import resource;
+except ImportError:  # finns inte på Windows
+    resource = None;
+
+try:
+    # malloc_trim finns bara i glibc
+    _LIBC = ctypes.CDLL(ctypes.util.find_library("c"));
+    _LIBC.malloc_trim;
+except (OSError, AttributeError, TypeError):
+    _LIBC = None;
+
+SIZES = [(640, 480), (1920, 1080), (4000, 3000), (8000, 6000)];
+QUICK_SIZES = [(640, 480), (1920, 1080)];
+WIDTHS = [80, 300, 1000];
+SHARD_WIDTHS = [2000, 4000];
+DITHER_TARGETS = {"none": 10.0, "ordered": 20.0, "fs": 40.0};
+
+def worker_counts():
+    '''1, 2, 4 ... upp till antalet kärnor (som sista värde även om det inte är en tvåpotens).'''
+    cores = os.cpu_count() or 1;
+    counts = [1];
+    while counts[-1] * 2 < cores:
+        counts.append(counts[-1] * 2);
+    if cores > 1:
+        counts.append(cores);
+    return counts;
+
+def make_image(path, size):
+    '''Skapa en syntetisk JPEG: diagonal gradient med brus, så att den liknar ett foto.'''
+    grad = Image.linear_gradient("L").rotate(45).resize(size);
+    noise = Image.effect_noise(size, 40);
+    img = Image.blend(grad, noise, 0.3).convert("RGB");
+    img.save(path, quality=90);
+
+def max_rss_kb():
+    '''Processens högsta minnesanvändning hittills (kB), eller None om det inte går att mäta.'''
+    if resource is None:
+        return None;
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss;
+    # macOS rapporterar byte, Linux kB
+    return rss // 1024 if sys.platform == "darwin" else rss;
+
+def _reset_peak_rss():
+    '''
+    Nollställ processens högsta RSS (VmHWM) inför ett steg. Går bara på Linux.
+    Först lämnas frigjort minne tillbaka (glibc malloc_trim), annars återanvänder
+    steget minne som redan räknas i RSS och ökningen syns inte.
+    :return: True om det gick
+    '''
+    if _LIBC is not None:
+        _LIBC.malloc_trim(0);
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5");
+        return True;
+    except OSError:
+        return False;
+
+def _peak_rss_kb():
+    '''Högsta RSS (kB) sedan _reset_peak_rss, eller None.'''
+    try:
+        with open("/proc/self/status", "r") as f:
+            m = re.search(r"VmHWM:\s+(\d+)", f.read());
+        return int(m.group(1)) if m else None;
+    except OSError:
+        return None;
+
+def timed(fn):
+    '''Kör fn utan minnesmätning och returnera (resultat, sekunder).'''
+    start = time.perf_counter();
+    result = fn();
+    return result, time.perf_counter() - start;
+
+def memory(fn):
+    '''
+    Kör fn en gång till för att mäta minnet (tiden räknas inte).
+    :return: (högsta Python-allokering i byte, största RSS-ökning under körningen i kB eller None)
+    '''
+    # direkt efter nollställningen är högsta RSS lika med nuvarande RSS
+    start = _peak_rss_kb() if _reset_peak_rss() else None;
+    tracemalloc.start();
+    try:
+        fn();
+        peak = tracemalloc.get_traced_memory()[1];
+    finally:
+        tracemalloc.stop();
+    end = _peak_rss_kb() if start is not None else None;
+    return peak, end - start if end is not None else None;
+
+def record(suite, stage, size, width, seconds, pixels, py_peak, rss_peak=None, **extra):
+    '''En mätpunkt i resultatlistan.'''
+    rec = {
+        "suite": suite,
+        "stage": stage,
+        "size": list(size),
+        "width": width,
+        "seconds": seconds,
+        "pixels_per_s": pixels / seconds if seconds > 0 else None,
+        "py_peak_bytes": py_peak,
+        "rss_peak_kb": rss_peak,
+        "max_rss_kb": max_rss_kb()
+    };
+    rec.update(extra);
+    return rec;
+
+def run_pipeline(path, size, widths, repeat):
+    '''
+    Mät load, _enhanced_resized och render_to_string för en bild.
+    Bästa tiden av repeat körningar räknas; varje körning börjar med en ny
+    AsciiArtImage, så första bredden inkluderar bygget av pyramiden.
+    Minnet mäts i ett eget varv i samma ordning efter tidsvarven.
+    Render-cachen har tak 0 så att inget hämtas från cachen.
+    '''
+    pixels = size[0] * size[1];
+
+    def stages(measure):
+        art = AsciiArtImage(path, cache=RenderCache(0));
+        yield ("load", None), measure(art.load);
+        art.set_brightness(1.2);
+        art.set_contrast(1.3);
+        for w in widths:
+            art.set_width(w);
+            yield ("enhance_resize", w), measure(art._enhanced_resized);
+            yield ("render", w), measure(art.render_to_string);
+
+    best = {};
+    for _ in range(repeat):
+        for key, (_, t) in stages(timed):
+            best[key] = min(t, best.get(key, t));
+    mem = dict(stages(memory));
+    return [record("pipeline", stage, size, w, t, pixels, *mem[(stage, w)]) for (stage, w), t in best.items()];
+
+def run_shards(path, size, widths, repeat, counts=None):
+    '''
+    Mät render_to_string med renderingen uppdelad på 1, 2, 4 ... processer.
+    Bilden laddas och pyramiden byggs före mätningen, så det är själva
+    radbanden (plus processtart och delat minne) som mäts. speedup är
+    relativt en process vid samma bredd. rss_peak_kb gäller bara
+    huvudprocessen, inte arbetsprocesserna.
+    '''
+    pixels = size[0] * size[1];
+    art = AsciiArtImage(path, cache=RenderCache(0));
+    art.load();
+    art.set_brightness(1.2);
+    art.set_contrast(1.3);
+    art._pyramid();
+    results = [];
+    for w in widths:
+        art.set_width(w);
+        single = None;
+        for n in counts or worker_counts():
+            art.set_shards(n);
+            t = min(timed(art.render_to_string)[1] for _ in range(repeat));
+            single = single or t;
+            results.append(record("shard", "render", size, w, t, pixels, *memory(art.render_to_string),
+                                  workers=n, speedup=single / t));
+    return results;
+
+def run_dither(size, repeat):
+    '''
+    Mät dithering plus teckenmappning per metod på en gråskalebild i full
+    storlek (utan resize), så att kostnaden per megapixel blir jämförbar
+    mellan storlekar. "none" är rak kvantisering som jämförelse.
+    '''
+    pixels = size[0] * size[1];
+    img = Image.blend(Image.linear_gradient("L").rotate(45).resize(size), Image.effect_noise(size, 40), 0.3);
+    charset = charsets.get(charsets.CHARSETS["standard"]);
+    levels = len(charset.chars) - 1;
+    results = [];
+    for method, target in DITHER_TARGETS.items():
+        job = lambda: charset.text(dithering.apply(img, levels, method).tobytes(), size[0]);
+        t = min(timed(job)[1] for _ in range(repeat));
+        ms_per_mp = t * 1000 / (pixels / 1e6);
+        results.append(record("dither", method, size, None, t, pixels, *memory(job),
+                              ms_per_mp=ms_per_mp, target_ms_per_mp=target, within_target=ms_per_mp <= target));
+    return results;
+
+def run(sizes, widths, repeat, suite="pipeline", counts=None):
+    '''Kör alla mätningar och returnera JSON-dokumentet som en dict.'''
+    results = [];
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            if suite == "dither":
+                # ditheringen mäts på en gråskalebild i minnet, ingen fil behövs
+                results.extend(run_dither(size, repeat));
+                continue;
+            path = os.path.join(tmp, f"bench_{size[0]}x{size[1]}.jpg");
+            make_image(path, size);
+            if suite == "shard":
+                results.extend(run_shards(path, size, widths, repeat, counts));
+            else:
+                results.extend(run_pipeline(path, size, widths, repeat));
+            os.remove(path);
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "cpu_count": os.cpu_count()
+        },
+        "results": results
+    };
+
+# Fält som är mätvärden; alla andra fält identifierar mätningen
+MEASURED = ("seconds", "pixels_per_s", "py_peak_bytes", "rss_peak_kb", "max_rss_kb", "speedup", "ms_per_mp", "within_target");
+
+def _key(rec):
+    '''Det som identifierar samma mätning i två körningar.'''
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                        for k, v in rec.items() if k not in MEASURED));
+
+def compare(current, baseline, threshold):
+    '''
+    Jämför två körningar.
+    :return: lista med (mätpunkt, baslinjetid, ny tid, relativ ändring) för
+             mätningar som blivit mer än threshold långsammare
+    '''
+    base = {_key(r): r["seconds"] for r in baseline["results"]};
+    regressions = [];
+    for rec in current["results"]:
+        old = base.get(_key(rec));
+        if old and rec["seconds"] > old * (1 + threshold):
+            regressions.append((rec, old, rec["seconds"], rec["seconds"] / old - 1));
+    return regressions;
+
+def main(argv=None):
+    '''Kör benchmark från kommandoraden. :return: exit-kod'''
+    parser = argparse.ArgumentParser(description="Benchmark för ASCII Art Studio");
+    parser.add_argument("--suite", choices=("pipeline", "shard", "dither"), default="pipeline");
+    parser.add_argument("--workers", type=int, nargs="+", help="antal processer för shard (standard: 1, 2, 4 ... kärnor)");
+    parser.add_argument("--quick", action="store_true", help="bara små bilder");
+    parser.add_argument("--widths", type=int, nargs="+", help="standard: WIDTHS, eller SHARD_WIDTHS för shard");
+    parser.add_argument("--repeat", type=int, default=3);
+    parser.add_argument("--output", help="spara JSON här istället för stdout");
+    parser.add_argument("--baseline", help="JSON från en tidigare körning att jämföra mot");
+    parser.add_argument("--threshold", type=float, default=0.2, help="tillåten försämring (0.2 = 20 %%)");
+    ns = parser.parse_args(argv);
+    sizes = QUICK_SIZES if ns.quick else SIZES;
+    if ns.suite == "shard":
+        # uppdelningen lönar sig först på stora bilder och breda renderingar
+        sizes = sizes[-1:];
+    widths = ns.widths or (SHARD_WIDTHS if ns.suite == "shard" else WIDTHS);
+    doc = run(sizes, widths, ns.repeat, ns.suite, ns.workers);
+    text = json.dumps(doc, indent=2);
+    if ns.output:
+        with open(ns.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n");
+    else:
+        print(text);
+    if not ns.baseline:
+        return 0;
+    with open(ns.baseline, "r", encoding="utf-8") as f:
+        regressions = compare(doc, json.load(f), ns.threshold);
+    for rec, old, new, change in regressions:
+        label = " ".join(f"{k}={v}" for k, v in _key(rec));
+        print(f"REGRESSION {label}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms (+{change:.0%})", file=sys.stderr);
+    return 1 if regressions else 0;
+
+if __name__ == "__main__":
+    sys.exit(main());
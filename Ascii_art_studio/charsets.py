@@ -0,0 +1,113 @@
+'''
+Teckenuppsättningar för renderingen: ett register med namngivna
+uppsättningar, automatisk rangordning efter hur mycket bläck varje tecken
+har, och en förberäknad 256-tabell per uppsättning som delas av alla bilder.
+
+Tecknen anges från mörkast till ljusast, som ASCII_CHARS.
+'''
+import threading;
+from functools import lru_cache;
+import numpy as np;
+from constants import ASCII_CHARS, CELL_SAMPLES;
+from glyphs import default_font, rasterize;
+
+# Namn -> tecken (mörkast först). "standard" rangordnas inte, så att standardutdata inte ändras.
+CHARSETS = {};
+_LOCK = threading.Lock();
+
+@lru_cache(maxsize=None)
+def char_table(chars):
+    '''
+    Bygg en 256-tabell: gråvärde -> index i chars.
+    Byggs en gång per teckenuppsättning och återanvänds sedan.
+    '''
+    n = len(chars) - 1;
+    return bytes((p * n) // 255 for p in range(256));
+
+def coverage(chars):
+    '''
+    Andel bläck (0..1) för varje tecken, mätt genom att rita det med
+    Pillows inbyggda bitmapfont. None om fonten inte har alla tecknen
+    (den täcker bara Latin-1).
+    '''
+    if any(ord(c) > 255 for c in chars):
+        return None;
+    return rasterize(chars, default_font(), CELL_SAMPLES["glyph"]).mean(axis=1).tolist();
+
+def rank(chars):
+    '''Sortera tecknen efter bläck, mest först; lika täckning behåller ordningen. Dubbletter tas bort.'''
+    chars = "".join(dict.fromkeys(chars));
+    cov = coverage(chars);
+    if cov is None:
+        return chars;
+    order = sorted(range(len(chars)), key=lambda i: -cov[i]);
+    return "".join(chars[i] for i in order);
+
+def register(name, chars, ranked=True):
+    '''
+    Lägg till (eller ersätt) en namngiven teckenuppsättning.
+    :param ranked: rangordna tecknen efter uppmätt bläck, annars används ordningen som den är
+    '''
+    if len(set(chars)) < 2:
+        raise ValueError("En teckenuppsättning behöver minst två olika tecken");
+    with _LOCK:
+        CHARSETS[name] = rank(chars) if ranked else chars;
+    return CHARSETS[name];
+
+class Charset:
+    '''
+    En teckenuppsättning redo att mappa gråskala till text.
+    Skapas via get(), så varje uppsättning och dess tabeller finns en gång per process.
+    '''
+
+    def __init__(self, chars):
+        self.chars = chars;
+        index = char_table(chars);
+        self.ascii = chars.isascii();
+        # ren ASCII mappas direkt med bytes.translate, annat via kodpunkter i NumPy
+        self.table = bytes(ord(chars[i]) for i in index) if self.ascii else None;
+        self.codes = np.array([ord(chars[i]) for i in index], dtype=np.uint32);
+
+    def row(self, data):
+        '''En rad gråvärden -> teckenraden som UTF-8-bytes.'''
+        if self.ascii:
+            return data.translate(self.table);
+        return self.codes[np.frombuffer(data, dtype=np.uint8)].astype("<u4").tobytes().decode("utf-32-le").encode("utf-8");
+
+    def rows(self, data, width):
+        '''Generera teckenraderna (UTF-8-bytes) för en gråskalebuffert med width pixlar per rad.'''
+        if self.ascii:
+            # hela bufferten mappas i ett svep i C, sedan delas den i rader
+            data = data.translate(self.table);
+            for i in range(0, len(data), width):
+                yield data[i:i + width];
+            return;
+        codes = self.codes[np.frombuffer(data, dtype=np.uint8)].reshape(-1, width);
+        for row in codes:
+            yield row.astype("<u4").tobytes().decode("utf-32-le").encode("utf-8");
+
+    def text(self, data, width):
+        '''Hela konsten som en sträng med radslut mellan raderna.'''
+        return b"\n".join(self.rows(data, width)).decode("utf-8");
+
+@lru_cache(maxsize=None)
+def get(chars):
+    '''Den delade Charset-instansen för chars.'''
+    return Charset(chars);
+
+def resolve(spec):
+    '''
+    Tolka ett charset-värde: ett namn i registret, annars tecknen själva
+    (som då rangordnas efter bläck).
+    :return: tecknen, mörkast först
+    '''
+    if spec in CHARSETS:
+        return CHARSETS[spec];
+    if len(set(spec)) < 2:
+        raise ValueError(f"Okänd charset '{spec}'. Finns: {', '.join(CHARSETS)}, eller ange minst två tecken");
+    return rank(spec);
+
+register("standard", ASCII_CHARS, ranked=False);
+register("detailed", "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\\|()1{}[]?-_+~<>i!lI;:,\"^`'. ");
+register("simple", "#+-. ");
+register("blocks", "█▓▒░ ");
@@ -5,3 +5,33 @@
 ASCII_CHARS = "@%#*+=-:. ";   # Från mörkast (@) till ljusast (mellanslag)
 DEFAULT_WIDTH = 50;           # Standardbredd på ASCII-bilder (antal tecken)
 STRETCH = 0.5;                 # Höjdkorrigering för att kompensera monospace-proportioner
+RENDER_CACHE_BYTES = 16 * 1024 * 1024;  # Minnestak för cachade renderingar per session (byte)
+PIPELINES = ("classic", "fused");   # classic: ljus/kontrast före resize, fused: en tabell efter resize
+PYRAMID_MIN_SIZE = 32;         # Minsta kortsida (pixlar) för en förminskad pyramidnivå
+DECODE_OVERSAMPLE = 2;         # Reducerad avkodning och vald pyramidnivå behåller minst så här många pixlar per tecken
+LOAD_WORKERS = 8;              # Antal trådar som läser in bilder parallellt vid load session
+FRAME_SEPARATOR = "\f";        # Rad mellan bildrutor när en animation sparas i en enda fil
+PLAY_FPS = 12.0;               # Standard bildrutor per sekund vid uppspelning i terminalen
+RENDER_MODES = ("ascii", "color", "half", "braille", "glyph");  # ascii: bara tecken, color: 24-bitars ANSI-färg, half/braille/glyph: se CELL_SAMPLES
+COLOR_LEVELS = 8;              # Antal nivåer per färgkanal i färgläget (färre = kortare utdata)
+STATS_SAMPLES = 1000;          # Antal senaste mätningar per steg som percentilerna räknas på
+DISK_CACHE_BYTES = 256 * 1024 * 1024;  # Storlekstak för render-cachen på disk (byte)
+DISK_CACHE_VERSION = 1;        # Räknas upp när renderingen ändras så att gamla cachefiler inte används
+TILE_ROWS = 256;               # Ungefärligt antal källrader per remsa vid tiled rendering
+SERVER_PORT = 8080;            # Standardport för "main.py serve" (lyssnar bara på localhost som standard)
+SERVER_WORKERS = 4;            # Trådar som renderar åt HTTP-servern
+SERVER_QUEUE = 32;             # Förfrågningar som får vänta utöver de som renderas, sedan svarar servern 503
+SERVER_MAX_DECODED = 16;       # Max antal bilder med avkodade pixlar i serverns session
+SERVER_MAX_IMAGES = 256;       # Max antal bilder (sökvägar och uppladdningar) som servern minns, äldst används tas bort
+SERVER_MAX_WIDTH = 2000;       # Största bredd (tecken) som servern renderar, större svarar 400
+SERVER_MAX_HEIGHT = 1000;      # Största höjd (rader) som servern renderar, även när den räknas fram ur bredden
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024;  # Största tillåtna uppladdade bild (byte)
+CELL_SAMPLES = {"half": (1, 2), "braille": (2, 4), "glyph": (4, 8)};  # Bildpunkter (bredd, höjd) per tecken i lägen med flera punkter per tecken
+DOT_THRESHOLD = 128;           # Gråvärden under detta blir en tänd punkt i half/braille
+GLYPH_CHARS = "".join(chr(c) for c in range(32, 127));  # Tecken som glyph-läget väljer bland (utskrivbar ASCII)
+GLYPH_INDEX_VERSION = 1;       # Räknas upp när glyfindexets format ändras så att gamla indexfiler inte används
+GLYPH_TONE_WEIGHT = 3.0;       # Hur mycket ljusheten väger mot formen när glyph-läget väljer tecken
+DITHERS = ("none", "ordered", "fs");  # none: rak kvantisering, ordered: Bayer-mönster, fs: Floyd–Steinberg
+BAYER_SIZE = 8;                # Storlek på Bayer-matrisen för ordered dithering (tvåpotens)
+ZOOM_STEP = 2.0;               # Faktor för "zoom in"/"zoom out"
+PAN_STEP = 0.25;               # Andel av den synliga delen som "pan left/right/up/down" flyttar
@@ -0,0 +1,117 @@
+import hashlib;
+import json;
+import os;
+import tempfile;
+from constants import DISK_CACHE_BYTES, DISK_CACHE_VERSION;
+
+def write_atomic(path, data):
+    '''
+    Skriv data (bytes) till path via en temporär fil i samma katalog och byt
+    sedan namn atomärt, så att en läsare aldrig ser en halvskriven fil.
+    Används av alla cachar på disk.
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp");
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data);
+        os.replace(tmp, path);
+    except BaseException:
+        try:
+            os.remove(tmp);
+        except OSError:
+            pass;
+        raise;
+
+class DiskRenderCache:
+    '''
+    Opt-in cache på disk för färdiga renderingar, som överlever omstarter.
+
+    Nyckeln är en SHA-256 av källfilens innehåll plus renderingsinställningarna.
+    Innehållshashen sparas bredvid med filens mtime och storlek, så en
+    oförändrad fil behöver inte läsas om för att hashas igen.
+    Alla skrivningar går via en temporär fil och os.replace, så flera processer
+    kan dela katalogen: en läsare ser antingen en hel fil eller ingen alls.
+    När cachen växer över max_bytes tas de minst nyligen använda filerna bort.
+    '''
+
+    def __init__(self, directory, max_bytes=DISK_CACHE_BYTES):
+        '''Använd (och skapa vid behov) katalogen directory.'''
+        self.directory = directory;
+        self.max_bytes = max_bytes;
+        self._renders = os.path.join(directory, "renders");
+        self._hashes = os.path.join(directory, "hashes");
+        os.makedirs(self._renders, exist_ok=True);
+        os.makedirs(self._hashes, exist_ok=True);
+
+    def source_digest(self, filename):
+        '''
+        Returnera SHA-256 (hex) av filens innehåll. Stämmer mtime och storlek
+        med det som sparades förra gången används den sparade hashen direkt.
+        '''
+        st = os.stat(filename);
+        stamp = [st.st_mtime_ns, st.st_size];
+        name = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest() + ".json";
+        meta_path = os.path.join(self._hashes, name);
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f);
+            if meta.get("stamp") == stamp:
+                return meta["digest"];
+        except (OSError, ValueError, KeyError):
+            pass;
+        h = hashlib.sha256();
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk);
+        digest = h.hexdigest();
+        write_atomic(meta_path, json.dumps({"stamp": stamp, "digest": digest}).encode("utf-8"));
+        return digest;
+
+    def key(self, filename, params):
+        '''Cachenyckel för en källfil och en lista med renderingsinställningar.'''
+        blob = json.dumps([DISK_CACHE_VERSION, self.source_digest(filename), params]);
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest();
+
+    def _path(self, key):
+        return os.path.join(self._renders, key + ".txt");
+
+    def get(self, key):
+        '''Returnera cachad rendering eller None. En träff räknas som användning (LRU).'''
+        path = self._path(key);
+        try:
+            with open(path, "rb") as f:
+                data = f.read();
+            os.utime(path);
+        except OSError:
+            # saknas, eller togs bort av en annan process mellan open och utime
+            return None;
+        return data.decode("utf-8");
+
+    def put(self, key, art):
+        '''Spara en rendering och rensa bort gamla om cachen blivit för stor.'''
+        write_atomic(self._path(key), art.encode("utf-8"));
+        self._evict();
+
+    def _evict(self):
+        '''Ta bort minst nyligen använda renderingar tills cachen är under max_bytes.'''
+        entries = [];
+        total = 0;
+        for entry in os.scandir(self._renders):
+            if not entry.name.endswith(".txt"):
+                continue;
+            try:
+                st = entry.stat();
+            except OSError:
+                continue;
+            entries.append((st.st_mtime_ns, st.st_size, entry.path));
+            total += st.st_size;
+        entries.sort();
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break;
+            try:
+                os.remove(path);
+            except OSError:
+                # en annan process hann först
+                pass;
+            total -= size;
@@ -0,0 +1,75 @@
+'''
+Dithering före teckenmappningen, så att jämna gradienter inte blir band
+när gråskalan kvantiseras till teckenuppsättningens få nivåer.
+
+Båda metoderna tar en gråskalebild och ett antal nivåintervall (tecken - 1)
+och returnerar en gråskalebild där varje pixel ligger på en nivå. Nivåerna
+väljs så att charsets.char_table mappar nivå k till exakt tecken k.
+'''
+from functools import lru_cache;
+import numpy as np;
+from PIL import Image;
+from constants import BAYER_SIZE;
+
+def _bayer(size):
+    '''Bayer-matris size x size (size en tvåpotens) med värdena 0 .. size² - 1.'''
+    m = np.zeros((1, 1), dtype=np.int32);
+    while m.shape[0] < size:
+        m = np.block([[4 * m, 4 * m + 2], [4 * m + 3, 4 * m + 1]]);
+    return m;
+
+# Tröskel per position, skalad till 0..254 så att allt kan räknas i heltal
+_THRESHOLDS = ((2 * _bayer(BAYER_SIZE) + 1) * 255 // (2 * BAYER_SIZE * BAYER_SIZE)).astype(np.uint16);
+
+def level_grays(levels):
+    '''Gråvärde för varje nivå 0..levels, avrundat uppåt så att char_table ger nivån tillbaka.'''
+    return np.array([-(-k * 255 // levels) for k in range(levels + 1)], dtype=np.uint8);
+
+@lru_cache(maxsize=None)
+def _ordered_lut(levels):
+    '''Tabell (position i matrisen * 256 + gråvärde) -> dithrat gråvärde, platt för np.take.'''
+    p = np.arange(256, dtype=np.uint16);
+    q = (p[None, :] * levels + _THRESHOLDS.reshape(-1, 1)) // 255;
+    return level_grays(levels)[q].ravel();
+
+def ordered(img, levels, y0=0):
+    '''
+    Ordnad dithering med Bayer-matris, helt i NumPy.
+    Nivån blir floor((p * levels + t) / 255) där t är positionens tröskel,
+    vilket i medel ger samma ljushet som p men sprider övergångarna i ett
+    jämnt mönster. Bilden delas i block av matrisens storlek och varje pixel
+    slås upp i en förberäknad tabell per matrisposition, i ett enda np.take.
+    :param y0: bildens första rad i hela renderingen (för band/remsor, så att mönstret fortsätter)
+    '''
+    w, h = img.size;
+    n = BAYER_SIZE;
+    ph, pw = -(-h // n) * n, -(-w // n) * n;
+    p = np.asarray(img);
+    if (ph, pw) != (h, w):
+        p = np.pad(p, ((0, ph - h), (0, pw - w)));
+    cells = np.arange(n * n, dtype=np.uint16).reshape(n, n);
+    offsets = (np.roll(cells, -(y0 % n), axis=0) * 256)[None, :, None, :];
+    out = np.take(_ordered_lut(levels), p.reshape(ph // n, n, pw // n, n) + offsets);
+    return Image.fromarray(np.ascontiguousarray(out.reshape(ph, pw)[:h, :w]));
+
+def floyd_steinberg(img, levels):
+    '''
+    Floyd–Steinberg via Pillows quantize, som diffunderar felet i C mot en
+    palett med levels + 1 gråtoner. Felet sprids åt höger inom raden, så
+    det går inte att vektorisera per rad utan att ändra resultatet; C-loopen
+    är både snabbare och exakt.
+    '''
+    grays = level_grays(levels);
+    pal = Image.new("P", (1, 1));
+    pal.putpalette([int(v) for v in grays for _ in range(3)]);
+    q = img.convert("RGB").quantize(palette=pal, dither=Image.Dither.FLOYDSTEINBERG);
+    # paletten har bara levels + 1 färger, så index -> gråvärde med en tabell
+    return Image.fromarray(grays[np.asarray(q)]);
+
+def apply(img, levels, method, y0=0):
+    '''Dithra img med method (se DITHERS), eller returnera den oförändrad för "none".'''
+    if method == "ordered":
+        return ordered(img, levels, y0);
+    if method == "fs":
+        return floyd_steinberg(img, levels);
+    return img;
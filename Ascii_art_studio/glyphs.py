@@ -0,0 +1,121 @@
+import hashlib;
+import io;
+import os;
+import threading;
+import numpy as np;
+import PIL;
+from PIL import Image, ImageDraw, ImageFont;
+from constants import CELL_SAMPLES, GLYPH_CHARS, GLYPH_INDEX_VERSION, GLYPH_TONE_WEIGHT;
+from diskcache import write_atomic;
+
+def default_font():
+    '''Pillows inbyggda bitmapfont (samma på alla maskiner, kräver ingen FreeType).'''
+    if hasattr(ImageFont, "load_default_imagefont"):
+        return ImageFont.load_default_imagefont();
+    return ImageFont.load_default();
+
+def _font_id():
+    '''Identifierar fonten i cache-nyckeln; den inbyggda fonten följer Pillow-versionen.'''
+    return f"pillow-default-bitmap-{PIL.__version__}";
+
+def rasterize(chars, font, cell):
+    '''
+    Rita varje tecken i en egen ruta och skala ner till cell (bredd, höjd) punkter.
+    :return: float32-matris (tecken x punkter) med täckning 0..1, 1 = svart bläck
+    '''
+    boxes = [font.getbbox(c) for c in chars];
+    w = max(1, max(b[2] for b in boxes));
+    h = max(1, max(b[3] for b in boxes));
+    rows = [];
+    for c in chars:
+        tile = Image.new("L", (w, h), 0);
+        ImageDraw.Draw(tile).text((0, 0), c, fill=255, font=font);
+        rows.append(np.asarray(tile.resize(cell, resample=Image.BOX), dtype=np.float32).ravel() / 255.0);
+    return np.stack(rows);
+
+class GlyphIndex:
+    '''
+    Glyfbitmappar för en teckenuppsättning, redo för närmaste-granne-sökning.
+
+    Avståndet mellan ett block och en glyf delas i form och ton: kvadratiskt
+    avstånd mellan de medelvärdesjusterade bitmapparna plus GLYPH_TONE_WEIGHT
+    gånger skillnaden i medeltäckning. Bara form ger för ljusa bilder (tunna
+    tecken ligger närmast allt som inte är helt svart), bara ton blir samma
+    sak som den vanliga rampen.
+    '''
+
+    def __init__(self, chars, matrix):
+        self.chars = chars;
+        self.matrix = np.asarray(matrix, dtype=np.float32);
+        self.codes = np.array([ord(c) for c in chars], dtype=np.uint32);
+        # inget tecken täcker hela cellen, så helsvart motsvarar det tätaste tecknet
+        self.scale = float(self.matrix.mean(axis=1).max()) or 1.0;
+        self.means = self.matrix.mean(axis=1);
+        self.shapes = self.matrix - self.means[:, None];
+        n = self.matrix.shape[1];
+        self.tone = GLYPH_TONE_WEIGHT * n;
+        self.bias = (self.shapes * self.shapes).sum(axis=1) + self.tone * self.means * self.means;
+
+    def match(self, blocks):
+        '''
+        Närmaste glyf för varje block, alla på en gång. Termer som bara beror
+        på blocket är lika för alla glyfer och stryks, och formdelen av
+        blocket behöver inte räknas fram eftersom glyfernas former har
+        medelvärde 0. Kvar blir en matrismultiplikation, en yttre produkt
+        och argmin per rad.
+        :param blocks: matris (block x punkter) med täckning 0..1
+        :return: kodpunkter, en per block
+        '''
+        blocks = blocks * self.scale;
+        scores = self.bias - 2.0 * (blocks @ self.shapes.T);
+        scores -= (2.0 * self.tone) * np.outer(blocks.mean(axis=1), self.means);
+        return self.codes[np.argmin(scores, axis=1)];
+
+class GlyphCache:
+    '''
+    Håller glyfindex per teckenuppsättning, i minnet och (om directory anges)
+    som .npy-filer på disk så att nästa start slipper rita om tecknen.
+    Filnamnet är en hash av font, teckenuppsättning, cellstorlek och
+    GLYPH_INDEX_VERSION.
+    '''
+
+    def __init__(self, directory=None):
+        ''':param directory: katalog för indexfilerna, None = bara i minnet'''
+        self.directory = directory;
+        if directory:
+            os.makedirs(directory, exist_ok=True);
+        self._indexes = {};
+        self._lock = threading.Lock();
+
+    def _path(self, chars, cell):
+        ident = f"{GLYPH_INDEX_VERSION}\0{_font_id()}\0{cell[0]}x{cell[1]}\0{chars}";
+        return os.path.join(self.directory, hashlib.sha1(ident.encode("utf-8")).hexdigest() + ".npy");
+
+    def index(self, chars=GLYPH_CHARS):
+        '''Glyfindex för chars: från minnet, från disk, eller ritat och sparat.'''
+        with self._lock:
+            idx = self._indexes.get(chars);
+            if idx is None:
+                idx = self._indexes[chars] = GlyphIndex(chars, self._matrix(chars));
+            return idx;
+
+    def _matrix(self, chars):
+        cell = CELL_SAMPLES["glyph"];
+        shape = (len(chars), cell[0] * cell[1]);
+        path = self._path(chars, cell) if self.directory else None;
+        if path:
+            try:
+                matrix = np.load(path);
+                if matrix.shape == shape:
+                    return matrix;
+            except (OSError, ValueError):
+                pass;
+        matrix = rasterize(chars, default_font(), cell);
+        if path:
+            buf = io.BytesIO();
+            np.save(buf, matrix);
+            write_atomic(path, buf.getvalue());
+        return matrix;
+
+# Delas av alla bilder som inte fått en egen GlyphCache (bara i minnet)
+GLYPHS = GlyphCache();
@@ -1,11 +1,30 @@
+import argparse;
+import asyncio;
+import contextlib;
+import os;
+import shlex;
+import sys;
+import animation;
+from asciiartimage import AsciiArtImage;
+import charsets;
+from constants import PAN_STEP, PLAY_FPS, SERVER_MAX_DECODED, SERVER_MAX_IMAGES, SERVER_PORT, SERVER_QUEUE, SERVER_WORKERS, ZOOM_STEP;
+from diskcache import DiskRenderCache;
+from glyphs import GlyphCache;
+from pixelcache import PixelCache;
+import server;
 from session import Session;
+from stats import STATS;
 
 USAGE = {
     "load": "load image <filename> [as <alias>] | load session <filename>",
-    "render": "render [img] | render <img> to <filename>",
-    "set": "set <img> width|height|brightness|contrast <value>  eller  set width|height|brightness|contrast <value>",
+    "render": "render [img] | render <img> to <filename> | render <img> frames to <file|dir/> | render all to <dir>",
+    "set": "set <img> width|height|brightness|contrast|pipeline|mode|charset|dither|tiled|shards <value>  eller  set width|height|brightness|contrast|pipeline|mode|charset|dither|tiled|shards <value>",
     "save": "save session as <filename>",
-    "help": "Kommandon: load, info, render, set, save, quit"
+    "zoom": "zoom [img] <faktor>|in|out|reset",
+    "pan": "pan [img] <dx> <dy>  eller  pan [img] left|right|up|down  (dx/dy i skärmbredder/-höjder)",
+    "play": "play <img|katalog> [fps]",
+    "stats": "stats [on|off|reset]",
+    "help": "Kommandon: load, info, render, set, zoom, pan, save, play, stats, quit"
 };
 
 def cmd_load(sess, args):
@@ -14,12 +33,12 @@ def cmd_load(sess, args):
     '''
     if len(args) < 1:
         print(USAGE["load"]);
-        return;
+        return False;
     sub = args[0].lower();
     if sub == "image":
         if len(args) < 2:
             print("load image <filename> [as <alias>]");
-            return;
+            return False;
         filename = args[1];
         # Om det står "as <alias>" så plockar vi aliaset, annars None
         # alias gör att användaren kan ladda samma fil flera gånger med olika namn
@@ -30,7 +49,7 @@ def cmd_load(sess, args):
     elif sub == "session":
         if len(args) < 2:
             print("load session <filename>");
-            return;
+            return False;
         try:
             sess.load_session(args[1]);
             print("Session laddad.");
@@ -38,6 +57,7 @@ def cmd_load(sess, args):
             print(f"Session laddad (med varningar): {w}");
     else:
         print("Okänt load-kommando.");
+        return False;
 
 def cmd_info(sess, args):
     '''Lista info om alla bilder i sessionen'''
@@ -50,14 +70,55 @@ def cmd_render(sess, args):
     '''
     if not args:
         #uppdaterar current när en specifik bild renderas
-        print(sess.render(None));
+        print_render(sess, None);
+    # "render all to <dir>" – om ingen bild råkar heta "all"
+    elif len(args) >= 3 and args[0].lower() == "all" and args[1].lower() == "to" and "all" not in sess.images:
+        return cmd_render_all(sess, args[2]);
+    # "render <img> frames to <fil|katalog/>" – alla bildrutor i t.ex. en GIF
+    elif len(args) >= 4 and args[1].lower() == "frames" and args[2].lower() == "to":
+        res = sess.render_frames(args[0], args[3]);
+        print(f"Sparade {res['frames']} bildrutor till '{args[3]}' ({res['fps']:.1f} rutor/s).");
     # Kolla om syntaxen är "render <img> to <fil>"
     elif len(args) >= 3 and args[1].lower() == "to":
         sess.render_to_file(args[0], args[2]);
         print(f"Sparade ASCII till '{args[2]}'.");
     else:
         # Annars: dumpa bilden direkt här
-        print(sess.render(args[0]));
+        print_render(sess, args[0]);
+
+def print_render(sess, name):
+    '''
+    Skriv renderingen till terminalen rad för rad via stdout:s binära buffert.
+    Saknas bufferten (t.ex. omdirigerad till StringIO) skrivs strängen som vanligt.
+    '''
+    out = getattr(sys.stdout, "buffer", None);
+    if out is None:
+        print(sess.render(name));
+        return;
+    sys.stdout.flush();
+    sess.write_render(name, out);
+    out.flush();
+
+def cmd_render_all(sess, out_dir):
+    '''
+    Rendera alla bilder i sessionen till out_dir parallellt och visa förlopp.
+    '''
+    if not sess.images:
+        print("Inga bilder i sessionen.");
+        return False;
+
+    def progress(done, total, name, err):
+        status = f"FEL: {err}" if err else "ok";
+        print(f"[{done}/{total}] {name}: {status}");
+
+    res = sess.render_all(out_dir, progress=progress);
+    print(
+        f"Renderade {res['rendered']} bilder till '{out_dir}' på {res['seconds']:.2f} s "
+        f"({res['images_per_s']:.1f} bilder/s, {res['chars_per_s']:.0f} tecken/s)."
+    );
+    if res["errors"]:
+        print(f"{len(res['errors'])} bilder misslyckades.");
+        return False;
 
 def cmd_set(sess, args):
     '''
@@ -66,7 +127,7 @@ def cmd_set(sess, args):
     '''
     if len(args) < 2:
         print(USAGE["set"]);
-        return;
+        return False;
     if len(args) >= 3:
         # Varianten med bildnamn först
         name, attr, val = args[0], args[1].lower(), args[2];
@@ -74,12 +135,12 @@ def cmd_set(sess, args):
         # säkerställer att vi inte råkar ändra en obestämd bild
         if not sess.current:
             print("Ingen aktuell bild. Ladda eller ange bildnamn.");
-            return;
+            return False;
         name, attr, val = sess.current, args[0].lower(), args[1];
     img = sess.get_by_name(name);
     if not img:
         print("Okänd bild.");
-        return;
+        return False;
     try:
         if attr == "width":
             img.set_width(val);
@@ -93,11 +154,105 @@ def cmd_set(sess, args):
         elif attr == "contrast":
             img.set_contrast(val);
             print(f"Contrast för '{name}' satt till {img.contrast}.");
+        elif attr == "pipeline":
+            img.set_pipeline(val);
+            print(f"Pipeline för '{name}' satt till {img.pipeline}.");
+        elif attr == "mode":
+            img.set_mode(val);
+            print(f"Mode för '{name}' satt till {img.mode}.");
+        elif attr == "charset":
+            img.set_charset(val);
+            print(f"Charset för '{name}' satt till {img.charset} ({img.chars}).");
+        elif attr == "dither":
+            img.set_dither(val);
+            print(f"Dither för '{name}' satt till {img.dither}.");
+        elif attr == "tiled":
+            img.set_tiled(val);
+            print(f"Tiled för '{name}' satt till {'on' if img.tiled else 'off'}.");
+        elif attr == "shards":
+            img.set_shards(val);
+            print(f"Shards för '{name}' satt till {img.shards}.");
         else:
-            print("Okänt attribut. width | height | brightness | contrast gäller.");
+            print("Okänt attribut. width | height | brightness | contrast | pipeline | mode | charset | dither | tiled | shards gäller.");
+            return False;
     except ValueError as e:
         # fångar oväntade fel i kommandon och fortsätter loopen
         print(f"Fel: {e}");
+        return False;
+
+# Riktningar för pan, som (dx, dy) i steg om PAN_STEP
+PAN_DIRECTIONS = {"left": (-1, 0), "right": (1, 0), "up": (0, -1), "down": (0, 1)};
+
+def _view_image(sess, args, values):
+    '''
+    Bilden som zoom/pan gäller: namnet först om args har fler än values
+    argument, annars current. :return: (namn, bild) eller (None, None)
+    '''
+    if len(args) > values:
+        name = args[0];
+    elif sess.current:
+        name = sess.current;
+    else:
+        print("Ingen aktuell bild. Ladda eller ange bildnamn.");
+        return None, None;
+    img = sess.get_by_name(name);
+    if not img:
+        print("Okänd bild.");
+        return None, None;
+    return name, img;
+
+def cmd_zoom(sess, args):
+    '''
+    Zooma in på (eller ut från) mitten av det som visas nu.
+    Utdata behåller sin storlek; bara utsnittet av bilden ändras.
+    '''
+    if not args or len(args) > 2:
+        print(USAGE["zoom"]);
+        return False;
+    name, img = _view_image(sess, args, 1);
+    if img is None:
+        return False;
+    val = args[-1].lower();
+    try:
+        if val == "reset":
+            img.reset_viewport();
+        elif val == "in":
+            img.set_viewport(img.zoom * ZOOM_STEP);
+        elif val == "out":
+            img.set_viewport(max(1.0, img.zoom / ZOOM_STEP));
+        else:
+            img.set_viewport(val);
+    except ValueError as e:
+        print(f"Fel: {e}");
+        return False;
+    cx, cy = img.center;
+    print(f"Zoom för '{name}' satt till {img.zoom:g} (centrum {cx:.3f}, {cy:.3f}).");
+
+def cmd_pan(sess, args):
+    '''
+    Flytta utsnittet när bilden är inzoomad. Utsnittet stannar vid bildens kanter.
+    '''
+    if not args:
+        print(USAGE["pan"]);
+        return False;
+    values = 1 if args[-1].lower() in PAN_DIRECTIONS else 2;
+    if len(args) < values or len(args) > values + 1:
+        print(USAGE["pan"]);
+        return False;
+    name, img = _view_image(sess, args, values);
+    if img is None:
+        return False;
+    if values == 1:
+        dx, dy = (d * PAN_STEP for d in PAN_DIRECTIONS[args[-1].lower()]);
+    else:
+        try:
+            dx, dy = float(args[-2]), float(args[-1]);
+        except ValueError:
+            print(USAGE["pan"]);
+            return False;
+    img.pan(dx, dy);
+    cx, cy = img.center;
+    print(f"Utsnitt för '{name}' flyttat till centrum {cx:.3f}, {cy:.3f} (zoom {img.zoom:g}).");
 
 def cmd_save(sess, args):
     '''
@@ -108,12 +263,73 @@ def cmd_save(sess, args):
         print(f"Session sparad som '{args[2]}'.");
     else:
         print(USAGE["save"]);
+        return False;
+
+def cmd_play(sess, args):
+    '''
+    Spela upp en animerad bild, eller en katalog med numrerade bilder,
+    i terminalen med differentiell omritning.
+    '''
+    if not args:
+        print(USAGE["play"]);
+        return False;
+    try:
+        fps = float(args[1]) if len(args) >= 2 else PLAY_FPS;
+        if fps <= 0:
+            raise ValueError;
+    except ValueError:
+        print("fps måste vara ett positivt tal.");
+        return False;
+    frames = None;
+    if os.path.isdir(args[0]):
+        paths = animation.numbered_images(args[0]);
+        if not paths:
+            print("Inga bilder i katalogen.");
+            return False;
+        img = AsciiArtImage(paths[0]);
+        # inställningarna behöver bara storleken, rutorna avkodas i play
+        img.load_header();
+        frames = animation.dir_frames(paths);
+    else:
+        img = sess.get_by_name(args[0]);
+        if not img:
+            print("Okänd bild.");
+            return False;
+    res = animation.play(img, frames, fps);
+    print(
+        f"Visade {res['shown']} rutor ({res['dropped']} tappade) på {res['seconds']:.2f} s: "
+        f"{res['fps']:.1f} rutor/s, {res['bytes_per_s'] / 1024:.1f} kB/s."
+    );
+
+def cmd_stats(sess, args):
+    '''
+    Visa tider per renderingssteg, eller slå på/av/nollställ mätningen.
+    '''
+    sub = args[0].lower() if args else "";
+    if sub == "on":
+        STATS.enable();
+        print("Mätning påslagen.");
+    elif sub == "off":
+        STATS.disable();
+        print("Mätning avslagen.");
+    elif sub == "reset":
+        STATS.reset();
+        print("Mätningar nollställda.");
+    elif not sub:
+        for ln in STATS.lines():
+            print(ln);
+        print(sess.render_cache.info_string());
+    else:
+        print(USAGE["stats"]);
+        return False;
 
 def cmd_help(sess, args):
     '''Visa snabbhjälp'''
     print(USAGE["help"]);
-    for k in ["load", "render", "set", "save"]:
+    for k in ["load", "render", "set", "zoom", "pan", "save", "play", "stats"]:
         print(f" - {USAGE[k]}");
+    print(f"Charsets: {', '.join(charsets.CHARSETS)} (eller egna tecken, som rangordnas efter bläck;"
+          " med mellanslag inom citattecken: set bild charset \" .:-=+*#%@\")");
 
 def cmd_quit(sess, args):
     '''Hejdå och stäng ner'''
@@ -127,12 +343,71 @@ COMMANDS = {
     "info": cmd_info,
     "render": cmd_render,
     "set": cmd_set,
+    "zoom": cmd_zoom,
+    "pan": cmd_pan,
     "save": cmd_save,
+    "play": cmd_play,
+    "stats": cmd_stats,
     "quit": cmd_quit,
     "q": cmd_quit
 };
 
-def main():
+def run_command(sess, parts):
+    '''
+    Kör ett redan uppdelat kommando via COMMANDS.
+    Bara kommandoordet gör vi till gemener, så filnamn behåller sina versaler.
+    :return: True om kommandot gick bra, annars False
+    '''
+    cmd, args = parts[0].lower(), parts[1:];
+    if cmd not in COMMANDS:
+        print("Okänt kommando. Skriv 'help'.");
+        return False;
+    try:
+        return COMMANDS[cmd](sess, args) is not False;
+    except Exception as e:
+        # till stderr, så att ett fel inte hamnar i renderad utdata vid omdirigering
+        print(f"Fel: {e}", file=sys.stderr);
+        return False;
+
+def split_command(line):
+    '''
+    Dela en kommandorad i ord. Citattecken ("..." eller '...') håller ihop ett
+    ord med mellanslag, t.ex. en egen teckenuppsättning: set bild charset " .:-=+*#%@".
+    Bakstreck och # är vanliga tecken, så Windows-sökvägar och teckenrader fungerar som de står.
+    :raises ValueError: om ett citattecken inte avslutas
+    '''
+    lex = shlex.shlex(line, posix=True);
+    lex.whitespace_split = True;
+    lex.commenters = "";
+    lex.escape = "";
+    try:
+        return list(lex);
+    except ValueError:
+        raise ValueError("Citattecknet avslutas aldrig");
+
+def run_script(sess, lines):
+    '''
+    Kör kommandon rad för rad utan prompt (tomma rader och #-kommentarer hoppas över).
+    Ett quit avslutar skriptet i förtid.
+    :return: exit-kod, 0 om alla kommandon gick bra, annars 1
+    '''
+    ok = True;
+    for line in lines:
+        line = line.strip();
+        if not line or line.startswith("#"):
+            continue;
+        try:
+            parts = split_command(line);
+        except ValueError as e:
+            print(f"Fel: {e}", file=sys.stderr);
+            ok = False;
+            continue;
+        if parts[0].lower() in ("quit", "q"):
+            break;
+        ok = run_command(sess, parts) and ok;
+    return 0 if ok else 1;
+
+def repl():
     '''
     Själva loopen för ASCII Art Studio
     Läser in rader från användaren, tolkar första ordet som kommando
@@ -143,22 +418,127 @@ def main():
     sess = Session();
     prompt = "AAS: ";
     while True:
-        line = input(prompt).strip().lower();
-        if line in ("quit", "q"):
+        try:
+            line = input(prompt).strip();
+        except EOFError:
+            line = "quit";
+        if line.lower() in ("quit", "q"):
             print("Bye!");
             break;
         if not line:
             continue;
+        try:
+            parts = split_command(line);
+        except ValueError as e:
+            print(f"Fel: {e}", file=sys.stderr);
+            continue;
+        run_command(sess, parts);
 
-        parts = line.split();
-        cmd, args = parts[0], parts[1:];
-        if cmd in COMMANDS:
-            try:
-                COMMANDS[cmd](sess, args);
-            except Exception as e:
-                print(f"Fel: {e}");
-        else:
-            print("Okänt kommando. Skriv 'help'.");
+def cmd_oneshot_render(ns):
+    '''
+    "main.py render <fil> [--width N] ... [-o ut.txt]": bygger samma kommandon
+    som i REPL:en och kör dem via COMMANDS. Statusutskrifter går till stderr
+    så att stdout bara innehåller själva ASCII-konsten.
+    '''
+    sess = Session(reduced_decode=True, disk_cache=_disk_cache(ns), pixel_cache=_pixel_cache(ns),
+                   glyph_cache=_glyph_cache(ns));
+    steps = [["load", "image", ns.file]];
+    for attr in ("width", "height", "brightness", "contrast", "pipeline", "mode", "charset", "dither", "shards"):
+        val = getattr(ns, attr);
+        if val is not None:
+            steps.append(["set", attr, str(val)]);
+    if ns.tiled:
+        steps.append(["set", "tiled", "on"]);
+    with contextlib.redirect_stdout(sys.stderr):
+        for parts in steps:
+            if not run_command(sess, parts):
+                return 1;
+        if ns.output:
+            return 0 if run_command(sess, ["render", ns.file, "to", ns.output]) else 1;
+    return 0 if run_command(sess, ["render", ns.file]) else 1;
+
+def cmd_oneshot_script(ns):
+    '''"main.py script [fil]": kör kommandon från fil, eller stdin om fil saknas/är "-".'''
+    sess = Session(disk_cache=_disk_cache(ns), pixel_cache=_pixel_cache(ns),
+                   glyph_cache=_glyph_cache(ns));
+    if ns.file in (None, "-"):
+        return run_script(sess, sys.stdin);
+    with open(ns.file, "r", encoding="utf-8") as f:
+        return run_script(sess, f);
+
+def _disk_cache(ns):
+    '''Disk-cache från --cache-dir, eller None om den inte angavs.'''
+    return DiskRenderCache(ns.cache_dir) if ns.cache_dir else None;
+
+def _pixel_cache(ns):
+    '''Pixelcache från --pixel-cache, eller None om den inte angavs.'''
+    return PixelCache(ns.pixel_cache) if ns.pixel_cache else None;
+
+def _glyph_cache(ns):
+    '''Glyfindex på disk från --glyph-cache, eller None om den inte angavs.'''
+    return GlyphCache(ns.glyph_cache) if ns.glyph_cache else None;
+
+def cmd_oneshot_serve(ns):
+    '''"main.py serve": kör HTTP-tjänsten (server.py) tills den avbryts med Ctrl-C.'''
+    sess = Session(max_decoded=ns.max_decoded, disk_cache=_disk_cache(ns), pixel_cache=_pixel_cache(ns),
+                   glyph_cache=_glyph_cache(ns));
+    try:
+        asyncio.run(server.serve(ns.host, ns.port, session=sess, workers=ns.workers, queue=ns.queue,
+                                 root=ns.root, max_images=ns.max_images));
+    except KeyboardInterrupt:
+        pass;
+    return 0;
+
+def build_parser():
+    '''Argument för icke-interaktiv körning (utan argument startar REPL:en).'''
+    parser = argparse.ArgumentParser(prog="main.py", description="ASCII Art Studio");
+    # cachekatalogerna gäller alla underkommandon
+    cache_opts = argparse.ArgumentParser(add_help=False);
+    cache_opts.add_argument("--cache-dir", help="katalog för renderingscache på disk (delas mellan körningar)");
+    cache_opts.add_argument("--pixel-cache", help="katalog för avkodade pixlar (minnesmappas vid nästa körning)");
+    cache_opts.add_argument("--glyph-cache", help="katalog för glyfindex (läget glyph)");
+    sub = parser.add_subparsers(dest="command", required=True);
+    p = sub.add_parser("render", parents=[cache_opts], help="rendera en bild och avsluta");
+    p.add_argument("file");
+    p.add_argument("--width");
+    p.add_argument("--height");
+    p.add_argument("--brightness");
+    p.add_argument("--contrast");
+    p.add_argument("--pipeline");
+    p.add_argument("--mode");
+    p.add_argument("--charset", help="namn (standard, detailed, simple, blocks) eller egna tecken");
+    p.add_argument("--dither", help="none, ordered (Bayer) eller fs (Floyd–Steinberg)");
+    p.add_argument("--shards", help="antal processer som delar på renderingen (radband)");
+    p.add_argument("--tiled", action="store_true", help="läs källan i remsor (för mycket stora bilder)");
+    p.add_argument("-o", "--output", help="textfil att spara till (annars stdout)");
+    p.set_defaults(func=cmd_oneshot_render);
+    p = sub.add_parser("script", parents=[cache_opts], help="kör REPL-kommandon från fil eller stdin utan prompt");
+    p.add_argument("file", nargs="?");
+    p.set_defaults(func=cmd_oneshot_script);
+    p = sub.add_parser("serve", parents=[cache_opts], help="HTTP-tjänst som renderar på begäran (GET/POST /render, GET /metrics)");
+    p.add_argument("--host", default="127.0.0.1");
+    p.add_argument("--port", type=int, default=SERVER_PORT);
+    p.add_argument("--workers", type=int, default=SERVER_WORKERS, help="renderingstrådar");
+    p.add_argument("--queue", type=int, default=SERVER_QUEUE, help="väntande förfrågningar innan 503");
+    p.add_argument("--max-decoded", type=int, default=SERVER_MAX_DECODED, help="bilder med pixlar i minnet");
+    p.add_argument("--max-images", type=int, default=SERVER_MAX_IMAGES,
+                   help="bilder (sökvägar och uppladdningar) som servern minns");
+    p.add_argument("--root", default=".", help="katalog som path=... utgår från");
+    p.set_defaults(func=cmd_oneshot_serve);
+    return parser;
+
+def main(argv=None):
+    '''
+    Startpunkt. Utan argument körs den interaktiva REPL:en, annars
+    one-shot-rendering eller skriptläge.
+    :return: exit-kod
+    '''
+    argv = sys.argv[1:] if argv is None else argv;
+    if not argv:
+        repl();
+        return 0;
+    ns = build_parser().parse_args(argv);
+    return ns.func(ns);
 
 if __name__ == "__main__":
-    main();
+    sys.exit(main());
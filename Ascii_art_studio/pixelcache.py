@@ -0,0 +1,62 @@
+import hashlib;
+import json;
+import mmap;
+import os;
+from PIL import Image;
+from diskcache import write_atomic;
+
+class PixelCache:
+    '''
+    Cache på disk för avkodade pixlar (gråskala och ev. RGB, även reducerade),
+    så att en bild inte behöver avkodas igen vid nästa "load session".
+
+    Pixlarna sparas som rå bytes med en liten JSON-fil bredvid som håller
+    källfilens mtime och storlek. Vid inläsning minnesmappas råfilen och
+    Pillow-bilden pekar direkt in i mappningen, utan kopiering. Har källfilen
+    ändrats (annan mtime eller storlek) räknas det som en miss.
+    '''
+
+    def __init__(self, directory):
+        '''Använd (och skapa vid behov) katalogen directory.'''
+        self.directory = directory;
+        os.makedirs(directory, exist_ok=True);
+
+    def _paths(self, filename, variant, mode):
+        '''Sökvägar (rådata, metadata) för en källfil, avkodningsvariant och bildläge.'''
+        ident = json.dumps([os.path.abspath(filename), variant, mode]);
+        base = os.path.join(self.directory, hashlib.sha1(ident.encode("utf-8")).hexdigest());
+        return base + ".raw", base + ".json";
+
+    @staticmethod
+    def _stamp(filename):
+        st = os.stat(filename);
+        return [st.st_mtime_ns, st.st_size];
+
+    def load(self, filename, variant, mode):
+        '''
+        Returnera en minnesmappad Pillow-bild (skrivskyddad) eller None vid miss.
+        :param variant: det som styrde avkodningen, t.ex. [gräns, färgläge]
+        :param mode: "L" eller "RGB"
+        '''
+        raw_path, meta_path = self._paths(filename, variant, mode);
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f);
+            if meta["stamp"] != self._stamp(filename) or meta["mode"] != mode:
+                return None;
+            size = tuple(meta["size"]);
+            with open(raw_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size != size[0] * size[1] * len(mode):
+                    return None;
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ);
+        except (OSError, ValueError, KeyError):
+            return None;
+        # frombuffer med "raw" och samma läge delar minnet med mappningen
+        return Image.frombuffer(mode, size, mm, "raw", mode, 0, 1);
+
+    def store(self, filename, variant, img):
+        '''Spara en avkodad bild. Rådata skrivs först, metadata sist, båda atomärt.'''
+        raw_path, meta_path = self._paths(filename, variant, img.mode);
+        meta = {"stamp": self._stamp(filename), "mode": img.mode, "size": list(img.size)};
+        write_atomic(raw_path, img.tobytes());
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"));
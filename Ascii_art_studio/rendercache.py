@@ -0,0 +1,86 @@
+import sys;
+import threading;
+from collections import OrderedDict;
+from constants import RENDER_CACHE_BYTES;
+
+class RenderCache:
+    '''
+    LRU-cache för färdiga ASCII-renderingar, begränsad i antal byte.
+    Delas av alla bilder i en session så att taket gäller hela sessionen.
+    Nycklarna är tupler där första elementet identifierar bilden.
+    '''
+
+    def __init__(self, max_bytes=RENDER_CACHE_BYTES):
+        '''Skapa en tom cache med givet minnestak (byte).'''
+        self.max_bytes = max_bytes;
+        self.entries = OrderedDict();
+        self.bytes = 0;
+        self.hits = 0;
+        self.misses = 0;
+        self._lock = threading.Lock();
+
+    def get(self, key):
+        '''Returnera cachad rendering eller None, och räkna träff/miss.'''
+        with self._lock:
+            value = self.entries.get(key);
+            if value is None:
+                self.misses += 1;
+                return None;
+            # senast använd hamnar sist, så den äldsta slängs först
+            self.entries.move_to_end(key);
+            self.hits += 1;
+            return value;
+
+    def put(self, key, value):
+        '''Lägg till en rendering och släng de äldsta tills taket håller.'''
+        size = sys.getsizeof(value);
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= sys.getsizeof(self.entries.pop(key));
+            if size > self.max_bytes:
+                return;
+            self.entries[key] = value;
+            self.bytes += size;
+            self._evict();
+
+    def invalidate(self, owner):
+        '''Ta bort alla renderingar som hör till en viss bild.'''
+        with self._lock:
+            for key in [k for k in self.entries if k[0] == owner]:
+                self.bytes -= sys.getsizeof(self.entries.pop(key));
+
+    def clear(self):
+        '''Töm cachen (räknarna behålls).'''
+        with self._lock:
+            self.entries.clear();
+            self.bytes = 0;
+
+    def set_limit(self, max_bytes):
+        '''
+        Ändra minnestaket.
+        :param max_bytes: icke-negativt heltal, 0 stänger av cachen
+        :raises ValueError: om max_bytes inte är ett icke-negativt heltal
+        '''
+        try:
+            max_bytes = int(max_bytes);
+            if max_bytes < 0:
+                raise ValueError;
+        except Exception:
+            raise ValueError("Cachegränsen måste vara ett icke-negativt heltal");
+        with self._lock:
+            self.max_bytes = max_bytes;
+            self._evict();
+
+    def _evict(self):
+        '''Släng minst nyligen använda poster tills vi är under taket.'''
+        while self.entries and self.bytes > self.max_bytes:
+            _, old = self.entries.popitem(last=False);
+            self.bytes -= sys.getsizeof(old);
+
+    def info_string(self):
+        '''Returnera en rad text med cachens status.'''
+        return (
+            f"Render cache: {len(self.entries)} renderingar, "
+            f"{self.bytes // 1024}/{self.max_bytes // 1024} kB, "
+            f"träffar: {self.hits}, missar: {self.misses}"
+        );
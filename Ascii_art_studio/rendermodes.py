@@ -0,0 +1,111 @@
+import re;
+import numpy as np;
+from constants import CELL_SAMPLES, COLOR_LEVELS, DOT_THRESHOLD;
+from glyphs import GLYPHS;
+
+ANSI_RESET = "\x1b[0m";
+ANSI_ESCAPE = re.compile("\x1b\\[[0-9;]*m");
+
+def visible_len(text):
+    '''Antal tecken i text som syns i terminalen, utan ANSI-färgkoder och radslut.'''
+    return len(ANSI_ESCAPE.sub("", text)) - text.count("\n");
+
+def color_lines(art):
+    '''
+    Generera rader med 24-bitars ANSI-färg (ESC[38;2;r;g;bm) före tecknen.
+
+    Tecknen väljs som vanligt från gråskalan. Färgerna tas från bildens
+    RGB-kopia, får ljus/kontrast som en tabell efter resize (som "fused")
+    och kvantiseras till COLOR_LEVELS nivåer per kanal i samma point-anrop.
+    Intilliggande tecken med samma färg slås ihop till en enda escape-kod;
+    var färgen byts räknas ut med NumPy för alla rader på en gång, så
+    Python-loopen går per färgbyte och inte per pixel.
+    '''
+    art._ensure_loaded();
+    rows = art._ascii_rows();
+    w, h = art.width, art.height;
+    tone = art._tone_table() if art.brightness != 1.0 or art.contrast != 1.0 else list(range(256));
+    step = 256 // COLOR_LEVELS;
+    # kvantisera till mitten av varje intervall så att färgerna inte blir för mörka
+    quant = [min(255, (tone[v] // step) * step + step // 2) for v in range(256)];
+    rgb = art._view_resized(art.rgb, (w, h)).point(quant * 3);
+    px = np.asarray(rgb);
+    change = np.ones((h, w), dtype=bool);
+    change[:, 1:] = np.any(px[:, 1:] != px[:, :-1], axis=2);
+    for y, row in enumerate(rows):
+        starts = np.flatnonzero(change[y]).tolist();
+        ends = starts[1:] + [w];
+        row = row.decode("utf-8");
+        parts = [];
+        for (r, g, b), a, e in zip(px[y, starts].tolist(), starts, ends):
+            parts.append(f"\x1b[38;2;{r};{g};{b}m{row[a:e]}");
+        parts.append(ANSI_RESET);
+        yield "".join(parts);
+
+# Tecken för (övre, undre) tänd halva: ingen, övre, undre, båda
+_HALF_CODES = np.array([0x20, 0x2580, 0x2584, 0x2588], dtype=np.uint32);
+
+# Bitvärde för varje punkt i en braille-cell (4 rader x 2 kolumner), enligt Unicode
+_BRAILLE_BITS = np.array([[0x01, 0x08], [0x02, 0x10], [0x04, 0x20], [0x40, 0x80]], dtype=np.uint32);
+
+def _dots(art):
+    '''
+    Bildpunkterna för lägen med flera punkter per tecken, som en bool-matris
+    (höjd x bredd i punkter) där True betyder tänd (mörk) punkt. Skalningen
+    går via _sample_size, så bredd och höjd fortsätter att räknas i tecken.
+    '''
+    art._ensure_loaded();
+    # dithering till två nivåer (av/på) ger gråtoner som mönster av punkter
+    img = art._dithered(art._enhanced_resized(art._sample_size()), 1);
+    return np.asarray(img) < DOT_THRESHOLD;
+
+def _code_lines(codes):
+    '''Gör om en matris med kodpunkter (rader x tecken) till textrader, utan loop per tecken.'''
+    for row in codes.astype("<u4"):
+        yield row.tobytes().decode("utf-32-le");
+
+def half_lines(art):
+    '''
+    Generera rader med halvblock (▀ ▄ █): varje tecken visar två punkter
+    ovanför varandra, så bilden får dubbelt så många rader punkter.
+    '''
+    h, w = art.height, art.width;
+    ch = CELL_SAMPLES["half"][1];
+    cells = _dots(art).reshape(h, ch, w);
+    yield from _code_lines(_HALF_CODES[cells[:, 0] + 2 * cells[:, 1]]);
+
+def braille_lines(art):
+    '''
+    Generera rader med braille-tecken (U+2800 och framåt): varje tecken är en
+    cell med 2x4 punkter. Punkterna packas till bitar för alla celler på en
+    gång med NumPy (reshape till celler och viktad summa).
+    '''
+    h, w = art.height, art.width;
+    cw, ch = CELL_SAMPLES["braille"];
+    cells = _dots(art).reshape(h, ch, w, cw);
+    codes = 0x2800 + np.einsum("ryxc,yc->rx", cells.astype(np.uint32), _BRAILLE_BITS);
+    yield from _code_lines(codes);
+
+def glyph_lines(art):
+    '''
+    Generera rader där varje tecken väljs efter form, inte bara ljushet:
+    bilden delas i block på 4x8 punkter och varje block får den glyf i
+    glyfindexet (GLYPH_CHARS ritade med Pillows inbyggda font) som ligger
+    närmast, alla block i samma matrisoperation.
+    '''
+    h, w = art.height, art.width;
+    cw, ch = CELL_SAMPLES["glyph"];
+    art._ensure_loaded();
+    img = art._enhanced_resized(art._sample_size());
+    ink = 1.0 - np.asarray(img, dtype=np.float32) / 255.0;
+    blocks = ink.reshape(h, ch, w, cw).transpose(0, 2, 1, 3).reshape(h * w, ch * cw);
+    index = (art.glyph_cache or GLYPHS).index();
+    yield from _code_lines(index.match(blocks).reshape(h, w));
+
+# Läge -> funktion som genererar raderna (det vanliga "ascii"-läget sköts i AsciiArtImage)
+MODE_LINES = {
+    "color": color_lines,
+    "half": half_lines,
+    "braille": braille_lines,
+    "glyph": glyph_lines
+};
@@ -0,0 +1,296 @@
+'''
+Lokal HTTP-tjänst för ASCII Art Studio, byggd på asyncio och en långlivad Session.
+
+    GET  /render?path=bild.jpg&width=120&brightness=1.2&contrast=1.1
+    POST /render?width=120            (bildens byte som body)
+    GET  /metrics                     (JSON: latens, kö, cache)
+
+Avkodade bilder ligger kvar i sessionen mellan förfrågningar (högst
+max_decoded åt gången, och högst max_images bilder alls) och varje
+förfrågan renderar en egen kopia (AsciiArtImage.derive), så samtidiga
+förfrågningar påverkar inte varandra.
+Själva renderingen körs i en trådpool; när workers + queue förfrågningar
+redan pågår svarar servern 503 direkt istället för att köa fler.
+'''
+import asyncio;
+import hashlib;
+import json;
+import os;
+import shutil;
+import tempfile;
+import threading;
+import time;
+from collections import OrderedDict;
+from concurrent.futures import ThreadPoolExecutor;
+from urllib.parse import parse_qs, urlsplit;
+from constants import (MAX_UPLOAD_BYTES, SERVER_MAX_DECODED, SERVER_MAX_HEIGHT, SERVER_MAX_IMAGES,
+                       SERVER_MAX_WIDTH, SERVER_QUEUE, SERVER_WORKERS);
+from session import Session;
+from stats import StageStats;
+
+# Inställningar som kan skickas som query-parametrar, i den ordning de sätts
+PARAMS = ("mode", "pipeline", "charset", "dither", "width", "height", "brightness", "contrast");
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+           411: "Length Required", 413: "Payload Too Large", 500: "Internal Server Error",
+           503: "Service Unavailable"};
+
+class HttpError(Exception):
+    '''Fel som ska bli ett HTTP-svar med given status.'''
+
+    def __init__(self, status, message):
+        super().__init__(message);
+        self.status = status;
+
+class RenderServer:
+    '''
+    HTTP-servern. Håller sessionen, trådpoolen och mätvärdena.
+    Starta med start() (eller serve()) och stäng med close().
+    '''
+
+    def __init__(self, session=None, workers=SERVER_WORKERS, queue=SERVER_QUEUE, root=".",
+                 max_upload=MAX_UPLOAD_BYTES, upload_dir=None, max_images=SERVER_MAX_IMAGES):
+        '''
+        :param session: Session att använda (annars en ny med max_decoded = SERVER_MAX_DECODED)
+        :param workers: antal renderingstrådar
+        :param queue: hur många förfrågningar som får vänta på en ledig tråd
+        :param root: katalog som path-parametern utgår från och inte får lämna
+        :param max_upload: största tillåtna body (byte)
+        :param upload_dir: var uppladdade bilder sparas (annars en temporär katalog)
+        :param max_images: hur många bilder sessionen får minnas; den som använts
+            längst sedan tas bort (och dess uppladdade fil raderas)
+        '''
+        self.session = session if session is not None else Session(max_decoded=SERVER_MAX_DECODED);
+        self.workers = workers;
+        self.limit = workers + queue;
+        self.root = os.path.realpath(root);
+        self.max_upload = max_upload;
+        self._own_uploads = upload_dir is None;
+        self.upload_dir = upload_dir or tempfile.mkdtemp(prefix="aas-uploads-");
+        self.max_images = max(1, max_images);
+        # sessionsnyckel -> uppladdad fil (eller None), senast använd sist
+        self._recent = OrderedDict();
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render");
+        # avkodning, pyramid och LRU i sessionen görs en i taget
+        self._prepare_lock = threading.Lock();
+        self._count_lock = threading.Lock();
+        self.stats = StageStats();
+        self.stats.enable();
+        self.in_flight = 0;
+        self.queued = 0;
+        self.max_queued = 0;
+        self.responses = {};
+        self.server = None;
+        self.port = None;
+
+    async def start(self, host="127.0.0.1", port=0):
+        '''Börja lyssna. port=0 väljer en ledig port, se self.port.'''
+        self.server = await asyncio.start_server(self._handle, host, port);
+        self.port = self.server.sockets[0].getsockname()[1];
+        return self;
+
+    async def close(self):
+        '''Sluta ta emot anslutningar och stäng trådpoolen.'''
+        if self.server is not None:
+            self.server.close();
+            await self.server.wait_closed();
+        self.pool.shutdown(wait=True);
+        if self._own_uploads:
+            shutil.rmtree(self.upload_dir, ignore_errors=True);
+
+    def metrics(self):
+        '''
+        Mätvärden som dict: antal svar per status, pågående och köade
+        förfrågningar, latens per steg (request, queue, render) och
+        sessionens render-cache.
+        '''
+        with self._count_lock:
+            counts = {
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "max_queue_depth": self.max_queued,
+                "limit": self.limit,
+                "responses": {str(k): v for k, v in sorted(self.responses.items())}
+            };
+        counts["latency"] = self.stats.snapshot();
+        cache = self.session.render_cache;
+        counts["cache"] = {"hits": cache.hits, "misses": cache.misses, "entries": len(cache.entries),
+                           "bytes": cache.bytes, "decoded": len(self.session._decoded)};
+        return counts;
+
+    async def _handle(self, reader, writer):
+        '''En anslutning: läs en förfrågan, svara och stäng.'''
+        start = time.perf_counter();
+        try:
+            method, target, body = await self._read_request(reader);
+            status, ctype, data = await self._route(method, target, body);
+        except HttpError as e:
+            status, ctype, data = e.status, "text/plain; charset=utf-8", (str(e) + "\n").encode("utf-8");
+        except Exception as e:
+            status, ctype, data = 500, "text/plain; charset=utf-8", f"Internt fel: {e}\n".encode("utf-8");
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {ctype}",
+                f"Content-Length: {len(data)}", "Connection: close"];
+        if status == 503:
+            head.append("Retry-After: 1");
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data);
+            await writer.drain();
+        except ConnectionError:
+            pass;
+        finally:
+            writer.close();
+        with self._count_lock:
+            self.responses[status] = self.responses.get(status, 0) + 1;
+        self.stats.record("request", time.perf_counter() - start);
+
+    async def _read_request(self, reader):
+        '''Läs förfrågningsraden, headers och ev. body. :return: (metod, mål, body)'''
+        line = await reader.readline();
+        parts = line.decode("latin-1").split();
+        if len(parts) != 3:
+            raise HttpError(400, "Ogiltig förfrågan");
+        headers = {};
+        while True:
+            h = await reader.readline();
+            if h in (b"\r\n", b"\n", b""):
+                break;
+            name, _, value = h.decode("latin-1").partition(":");
+            headers[name.strip().lower()] = value.strip();
+        body = b"";
+        if parts[0] == "POST":
+            if "content-length" not in headers:
+                raise HttpError(411, "Content-Length krävs");
+            try:
+                length = int(headers["content-length"]);
+            except ValueError:
+                raise HttpError(400, "Ogiltig Content-Length");
+            if length > self.max_upload:
+                raise HttpError(413, f"Bilden är större än {self.max_upload} byte");
+            body = await reader.readexactly(length);
+        return parts[0], parts[1], body;
+
+    async def _route(self, method, target, body):
+        '''Välj svar efter sökväg och metod. :return: (status, content-type, byte)'''
+        url = urlsplit(target);
+        if url.path == "/metrics":
+            return 200, "application/json", json.dumps(self.metrics(), indent=2).encode("utf-8");
+        if url.path != "/render":
+            raise HttpError(404, "Okänd sökväg. /render och /metrics finns.");
+        if method not in ("GET", "POST"):
+            raise HttpError(405, "Bara GET och POST stöds");
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()};
+        art = await self._submit(query, body if method == "POST" else None);
+        return 200, "text/plain; charset=utf-8", (art + "\n").encode("utf-8");
+
+    async def _submit(self, query, upload):
+        '''Lägg renderingen i trådpoolen, eller svara 503 om gränsen är nådd.'''
+        with self._count_lock:
+            if self.in_flight >= self.limit:
+                raise HttpError(503, "Servern är upptagen, försök igen");
+            self.in_flight += 1;
+            self.queued += 1;
+            self.max_queued = max(self.max_queued, self.queued);
+        try:
+            loop = asyncio.get_running_loop();
+            return await loop.run_in_executor(self.pool, self._job, query, upload, time.perf_counter());
+        finally:
+            with self._count_lock:
+                self.in_flight -= 1;
+
+    def _job(self, query, upload, submitted):
+        '''Körs i en renderingstråd: räkna kötiden och rendera.'''
+        with self._count_lock:
+            self.queued -= 1;
+        self.stats.record("queue", time.perf_counter() - submitted);
+        try:
+            with self.stats.time("render"):
+                return self._run(query, upload);
+        except HttpError:
+            raise;
+        except FileNotFoundError as e:
+            raise HttpError(404, str(e));
+        except (ValueError, RuntimeError) as e:
+            raise HttpError(400, str(e));
+
+    def _source(self, query, upload):
+        '''
+        Filnamn och sessionsnyckel för bilden: uppladdad (efter innehållets hash) eller path.
+        :return: (filnamn, nyckel, om bilden laddades upp)
+        '''
+        if upload:
+            digest = hashlib.sha256(upload).hexdigest();
+            path = os.path.join(self.upload_dir, digest);
+            if not os.path.exists(path):
+                tmp = path + f".{threading.get_ident()}.tmp";
+                with open(tmp, "wb") as f:
+                    f.write(upload);
+                os.replace(tmp, path);
+            return path, "upload:" + digest, True;
+        if not query.get("path"):
+            raise HttpError(400, "Ange path=... eller skicka bilden som body (POST)");
+        path = os.path.realpath(os.path.join(self.root, query["path"]));
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise HttpError(403, "Sökvägen ligger utanför serverns rotkatalog");
+        return path, path, False;
+
+    def _base(self, path, key, upload):
+        '''
+        Sessionens bild för key (läggs till vid behov). Körs under _prepare_lock.
+        Bilder utöver max_images tas bort i LRU-ordning, så att en server som
+        länge tar emot nya sökvägar och uppladdningar inte växer utan gräns.
+        '''
+        base = self.session.images.get(key);
+        if base is None:
+            try:
+                base = self.session.add_image(path, key);
+            except FileNotFoundError:
+                if not upload:
+                    raise;
+                # uppladdningen hamnade aldrig i _recent, så den städas bort här
+                try:
+                    os.remove(path);
+                except OSError:
+                    pass;
+                raise HttpError(400, "Uppladdningen är ingen bild som kan läsas");
+        self._recent[key] = path if upload else None;
+        self._recent.move_to_end(key);
+        while len(self._recent) > self.max_images:
+            old, old_upload = self._recent.popitem(last=False);
+            self.session.remove_image(old);
+            if old_upload:
+                try:
+                    os.remove(old_upload);
+                except OSError:
+                    pass;
+        return base;
+
+    def _run(self, query, upload):
+        '''
+        Hämta (eller lägg till och avkoda) bilden i sessionen, gör en kopia
+        med förfrågans inställningar och rendera kopian.
+        '''
+        with self._prepare_lock:
+            # uppladdningen skrivs under låset så att _base inte hinner radera den
+            path, key, uploaded = self._source(query, upload);
+            base = self._base(path, key, uploaded);
+            # den delade bilden ändras inte; färgläget får bara sin RGB-kopia avkodad
+            base._ensure_loaded(color=query.get("mode", "").lower() == "color");
+            base._pyramid();
+            art = base.derive();
+            self.session._touch(base);
+        for name in PARAMS:
+            if name in query:
+                getattr(art, "set_" + name)(query[name]);
+        # höjden räknas fram ur bredden (och tvärtom), så båda kontrolleras efteråt
+        if art.width > SERVER_MAX_WIDTH or art.height > SERVER_MAX_HEIGHT:
+            raise HttpError(400, f"Storleken får vara högst {SERVER_MAX_WIDTH}x{SERVER_MAX_HEIGHT} tecken");
+        return art.render_to_string();
+
+async def serve(host="127.0.0.1", port=0, **kwargs):
+    '''Starta en RenderServer och kör tills processen avbryts.'''
+    srv = await RenderServer(**kwargs).start(host, port);
+    print(f"Lyssnar på http://{host}:{srv.port}/render (metrics: /metrics)");
+    try:
+        await srv.server.serve_forever();
+    finally:
+        await srv.close();
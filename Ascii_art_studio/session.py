@@ -1,5 +1,17 @@
 import json;
+import os;
+import re;
+import time;
+from collections import OrderedDict;
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed;
+import animation;
 from asciiartimage import AsciiArtImage;
+from constants import LOAD_WORKERS, RENDER_CACHE_BYTES;
+from diskcache import DiskRenderCache;
+from glyphs import GlyphCache;
+from pixelcache import PixelCache;
+from rendercache import RenderCache;
+from stats import STATS;
 
 class Session:
     '''
@@ -8,28 +20,65 @@ class Session:
     och kan spara/ladda sessioner eller spotta ut renderingar.
     '''
 
-    def __init__(self):
-        '''Startar på noll – inga bilder, ingen current.'''
+    def __init__(self, cache_bytes=RENDER_CACHE_BYTES, reduced_decode=False, max_decoded=None,
+                 load_workers=LOAD_WORKERS, disk_cache=None, pixel_cache=None, glyph_cache=None):
+        '''
+        Startar på noll – inga bilder, ingen current.
+        :param cache_bytes: minnestak för sessionens gemensamma render-cache
+        :param reduced_decode: avkoda bilder bara i den upplösning renderingen behöver
+        :param max_decoded: max antal bilder med avkodade pixlar samtidigt (None = obegränsat)
+        :param load_workers: antal trådar som load_session använder
+        :param disk_cache: valfri DiskRenderCache som delas av alla bilder (och batch-processer)
+        :param pixel_cache: valfri PixelCache med avkodade pixlar för snabbare omladdning
+        :param glyph_cache: valfri GlyphCache med glyfindex på disk (för läget glyph)
+        '''
         self.images = {};
         self.current = None;
+        self.render_cache = RenderCache(cache_bytes);
+        self.reduced_decode = reduced_decode;
+        self.max_decoded = max_decoded;
+        self.load_workers = load_workers;
+        self.disk_cache = disk_cache;
+        self.pixel_cache = pixel_cache;
+        self.glyph_cache = glyph_cache;
+        # senast renderade bilder sist, så de äldsta släpper sina pixlar först
+        self._decoded = OrderedDict();
 
     def add_image(self, filename, alias=None):
         '''
         Laddar in en ny bild och gör den till current.
+        Bara filhuvudet läses här, pixlarna avkodas vid första renderingen.
 
         :param filename: Sökväg till bildfilen
         :param alias: Valfritt alias att använda som nyckel
         :return: AsciiArtImage-objektet
         '''
-        img = AsciiArtImage(filename, alias);
-        #laddar bilden i minnet så att efterföljande operationer kan göras
-        img.load();  # faktiska pixlar in
+        img = AsciiArtImage(filename, alias, self.render_cache);
+        img.disk_cache = self.disk_cache;
+        img.pixel_cache = self.pixel_cache;
+        img.glyph_cache = self.glyph_cache;
+        #läser storleken direkt så att width/height kan sättas innan pixlarna behövs
+        img.load_header(self.reduced_decode);
         key = alias if alias else filename;
         self.images[key] = img;
         #så att den senast inladdade bilden alltid blir aktiv automatiskt
         self.current = key;
         return img;
 
+    def remove_image(self, key):
+        '''
+        Ta bort en bild ur sessionen och släpp dess pixlar.
+        :return: AsciiArtImage-objektet, eller None om nyckeln inte fanns
+        '''
+        img = self.images.pop(key, None);
+        if img is None:
+            return None;
+        self._decoded.pop(img, None);
+        img.unload();
+        if self.current == key:
+            self.current = None;
+        return img;
+
     def get_by_name(self, name):
         '''
         Hitta bildobjekt från alias eller filnamn.
@@ -52,18 +101,137 @@ class Session:
         Returnerar en ASCII-sträng av bilden.
         Om inget namn görs på på current.
         '''
+        img = self._resolve(name);
+        with STATS.time("render"):
+            art = img.render_to_string();
+        self._touch(img);
+        return art;
+
+    def write_render(self, name, stream):
+        '''
+        Skriv renderingen rad för rad till en binär ström (fil, stdout.buffer).
+        Hela konsten byggs aldrig upp som en sträng i minnet.
+        :return: antal tecken som skrevs (utan radslut och ANSI-färgkoder)
+        '''
+        img = self._resolve(name);
+        with STATS.time("write"):
+            count = img.write_to(stream);
+        self._touch(img);
+        return count;
+
+    def render_frames(self, name, target):
+        '''
+        Rendera alla bildrutor (t.ex. i en animerad GIF) till fil.
+        Är target en befintlig katalog, eller slutar på /, blir det en fil per ruta.
+        :return: dict med antal rutor, tid och rutor per sekund
+        '''
+        img = self._resolve(name);
+        split = os.path.isdir(target) or target.endswith(("/", os.sep));
+        res = animation.write_frames(img, target, split);
+        self._touch(img);
+        return res;
+
+    def stats(self):
+        '''
+        Tider per steg (decode, pyramid, enhance, resize, map, render, write)
+        sedan mätningen slogs på, plus render-cachens träffar och missar.
+        :return: dict med steg -> {count, total, mean, p50, p95, p99, max}
+                 och nyckeln "cache" -> {hits, misses, entries, bytes}
+        '''
+        snap = STATS.snapshot();
+        snap["cache"] = {
+            "hits": self.render_cache.hits,
+            "misses": self.render_cache.misses,
+            "entries": len(self.render_cache.entries),
+            "bytes": self.render_cache.bytes
+        };
+        return snap;
+
+    def _resolve(self, name):
+        '''Hitta bilden att rendera: name om det är angivet, annars current.'''
         img = self.get_by_name(name) if name else self.images.get(self.current);
         if not img:
             raise ValueError("Ingen bild att rendera.");
-        return img.render_to_string();
+        return img;
+
+    def _touch(self, img):
+        '''
+        Markera bilden som senast använd och släpp pixlarna i de bilder
+        som använts längst sedan, om max_decoded är satt.
+        '''
+        self._decoded[img] = None;
+        self._decoded.move_to_end(img);
+        if self.max_decoded is None:
+            return;
+        while len(self._decoded) > max(1, self.max_decoded):
+            old, _ = self._decoded.popitem(last=False);
+            old.unload();
 
     def render_to_file(self, name, out_filename):
         '''
-        Rendera och spara till textfil.
+        Rendera och spara till textfil (UTF-8), rad för rad via en buffrad binär fil.
+        '''
+        with open(out_filename, "wb") as f:
+            self.write_render(name, f);
+
+    def render_all(self, out_dir, workers=None, progress=None):
         '''
-        art = self.render(name);
-        with open(out_filename, "w", encoding="utf-8") as f:
-            f.write(art + "\n");
+        Rendera alla bilder i sessionen till textfiler i out_dir, parallellt
+        över CPU-kärnorna med en processpool. Varje process får bara bildens
+        metadata (to_dict) och läser själv in filen, så inga pixlar skickas.
+
+        :param out_dir: katalog för .txt-filerna (skapas vid behov)
+        :param workers: antal processer, None = antal kärnor
+        :param progress: valfri funktion progress(klara, totalt, namn, fel)
+        :return: dict med antal, fel, tid och genomströmning
+        '''
+        os.makedirs(out_dir, exist_ok=True);
+        jobs = {};
+        used = set();
+        for key, img in self.images.items():
+            path = os.path.join(out_dir, self._out_name(key, used) + ".txt");
+            jobs[key] = (img.to_dict(), path);
+        errors = [];
+        chars = 0;
+        start = time.perf_counter();
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            disk = (self.disk_cache.directory, self.disk_cache.max_bytes) if self.disk_cache else None;
+            pixels = self.pixel_cache.directory if self.pixel_cache else None;
+            glyphs = self.glyph_cache.directory if self.glyph_cache else None;
+            futures = {pool.submit(_render_job, d, path, self.reduced_decode, disk, pixels, glyphs): key
+                       for key, (d, path) in jobs.items()};
+            for done, fut in enumerate(as_completed(futures), 1):
+                key = futures[fut];
+                err = None;
+                try:
+                    chars += fut.result();
+                except Exception as e:
+                    err = str(e);
+                    errors.append((key, err));
+                if progress:
+                    progress(done, len(jobs), key, err);
+        elapsed = max(time.perf_counter() - start, 1e-9);
+        rendered = len(jobs) - len(errors);
+        return {
+            "rendered": rendered,
+            "errors": errors,
+            "seconds": elapsed,
+            "chars": chars,
+            "images_per_s": rendered / elapsed,
+            "chars_per_s": chars / elapsed
+        };
+
+    @staticmethod
+    def _out_name(key, used):
+        '''Gör ett unikt, filsystemvänligt filnamn (utan ändelse) av en bildnyckel.'''
+        base = os.path.splitext(os.path.basename(key))[0] or "image";
+        base = re.sub(r"[^\w.-]", "_", base);
+        name, n = base, 2;
+        while name in used:
+            name = f"{base}_{n}";
+            n += 1;
+        used.add(name);
+        return name;
 
     def info_lines(self):
         '''
@@ -75,8 +243,13 @@ class Session:
             lines.append(img.info_string());
         cur = self.current if self.current else "(ingen)";
         lines.append(f"Current image: {cur}");
+        lines.append(self.render_cache.info_string());
         return lines;
 
+    def set_cache_limit(self, max_bytes):
+        '''Ändra minnestaket för sessionens render-cache (byte).'''
+        self.render_cache.set_limit(max_bytes);
+
     def save_session(self, filename):
         '''
         Sparar sessionens metadata till JSON.
@@ -89,20 +262,63 @@ class Session:
         with open(filename, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2);
 
-    def load_session(self, filename):
+    def load_session(self, filename, workers=None, preload=False):
         '''
         Laddar in en session från JSON-fil.
         Skapar nya AsciiArtImage-objekt från sparad metadata.
+        Bilderna öppnas parallellt i en trådpool (Pillow släpper GIL:en vid
+        fil-I/O och avkodning), men resultatet läggs in i sparad ordning.
+
+        :param workers: antal trådar, None = sessionens load_workers
+        :param preload: avkoda pixlarna direkt istället för vid första renderingen
         '''
         with open(filename, "r", encoding="utf-8") as f:
             data = json.load(f);
         self.images = {};
-        for d in data.get("images", []):
-            try:
-                img = AsciiArtImage.from_dict(d);
-                key = img.alias if img.alias else img.filename;
-                self.images[key] = img;
-            except Exception:
+        self._decoded.clear();
+        self.render_cache.clear();
+        entries = data.get("images", []);
+        workers = self.load_workers if workers is None else workers;
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            # map() ger resultaten i samma ordning som entries, oavsett vilken tråd som blir klar först
+            results = list(pool.map(lambda d: self._load_entry(d, preload), entries));
+        for d, img in zip(entries, results):
+            if img is None:
                 # Om nåt gick fel med just den bilden – hoppa vidare
                 print(f"Kunde inte ladda '{d.get('filename')}'");
+                continue;
+            key = img.alias if img.alias else img.filename;
+            self.images[key] = img;
         self.current = data.get("current");
+
+    def _load_entry(self, d, preload):
+        '''Skapa en bild från sparad metadata, eller None om det misslyckas.'''
+        try:
+            img = AsciiArtImage.from_dict(d, self.render_cache, self.reduced_decode, lazy=True);
+            img.disk_cache = self.disk_cache;
+            img.pixel_cache = self.pixel_cache;
+            img.glyph_cache = self.glyph_cache;
+            if preload:
+                img._ensure_loaded();
+        except Exception:
+            return None;
+        return img;
+
+
+def _render_job(d, out_filename, reduced, disk=None, pixels=None, glyphs=None):
+    '''
+    Körs i en arbetsprocess: ladda bilden från metadata, rendera och spara.
+    :param disk: (katalog, max_bytes) för en delad disk-cache, eller None
+    :param pixels: katalog för en delad PixelCache, eller None
+    :param glyphs: katalog för en delad GlyphCache, eller None
+    :return: antal tecken i renderingen
+    '''
+    img = AsciiArtImage.from_dict(d, reduced=reduced, lazy=True);
+    if disk:
+        img.disk_cache = DiskRenderCache(*disk);
+    if pixels:
+        img.pixel_cache = PixelCache(pixels);
+    if glyphs:
+        img.glyph_cache = GlyphCache(glyphs);
+    with open(out_filename, "wb") as f:
+        return img.write_to(f);
@@ -0,0 +1,67 @@
+from concurrent.futures import ProcessPoolExecutor;
+from multiprocessing import shared_memory;
+from PIL import Image;
+import charsets;
+import dithering;
+import tiled;
+
+def _render_band(job):
+    '''
+    Körs i en arbetsprocess: rendera utdataraderna r0..r1 ur källbilden i
+    delat minne. Bara de källrader bandet behöver kopieras ut; tillbaka
+    skickas bandets teckenrader (UTF-8-bytes, utan radslut).
+    '''
+    name, size, W, H, r0, r1, tone, fused, chars, dither, view = job;
+    shm = shared_memory.SharedMemory(name=name);
+    try:
+        y0, y1, box = tiled.band_rows(size[0], size[1], H, r0, r1, view);
+        src = Image.frombuffer("L", size, shm.buf, "raw", "L", 0, 1);
+        strip = src.crop((0, y0, size[0], y1));
+        # bilden pekar in i shm.buf och måste släppas innan minnet stängs
+        del src;
+    finally:
+        shm.close();
+    if tone and not fused:
+        strip = strip.point(tone);
+    img = strip.resize((W, r1 - r0), resample=Image.BILINEAR, box=box);
+    if tone and fused:
+        img = img.point(tone);
+    # ordered fortsätter mönstret från bandets första rad (fs körs aldrig i band)
+    img = dithering.apply(img, len(chars) - 1, dither, r0);
+    return list(charsets.get(chars).rows(img.tobytes(), W));
+
+def iter_sharded_rows(art, shards):
+    '''
+    Generera teckenraderna (UTF-8-bytes) för art med renderingen uppdelad i
+    shards radband som körs parallellt i arbetsprocesser.
+
+    Källbilden (minsta pyramidnivån som räcker) läggs en gång i delat minne,
+    så bara bandgränser och tabeller skickas till processerna. Varje band
+    klipper ut sina källrader med marginal för filtret och skalar dem med en
+    box, så resultatet blir som en resize av hela bilden. Banden lämnas
+    tillbaka i ordning och raderna genereras allt eftersom.
+    '''
+    if not art.height or art.height <= 0:
+        art._calc_height_from_width();
+    art._ensure_loaded();
+    W, H = art.width, art.height;
+    src = art._source_for(art._view_need((W, H)));
+    fused = art.pipeline == "fused";
+    # classic tar kontrastens medelvärde från samma nivå som en vanlig rendering
+    tone = art._tone_table(None if fused else src) if art.brightness != 1.0 or art.contrast != 1.0 else None;
+
+    shards = max(1, min(shards, H));
+    bounds = [(H * i // shards, H * (i + 1) // shards) for i in range(shards)];
+    data = src.tobytes();
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)));
+    try:
+        shm.buf[:len(data)] = data;
+        del data;
+        jobs = [(shm.name, src.size, W, H, r0, r1, tone, fused, art.chars, art.dither,
+                 art._view_box(src.size)) for r0, r1 in bounds];
+        with ProcessPoolExecutor(max_workers=shards) as pool:
+            for band in pool.map(_render_band, jobs):
+                yield from band;
+    finally:
+        shm.close();
+        shm.unlink();
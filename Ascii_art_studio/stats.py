@@ -0,0 +1,103 @@
+import threading;
+import time;
+from collections import deque;
+from contextlib import nullcontext;
+from constants import STATS_SAMPLES;
+
+# Delas av alla avstängda mätpunkter, så att "with STATS.time(...)" nästan inte kostar något
+_OFF = nullcontext();
+
+class _Timer:
+    '''Context manager som mäter tiden för ett steg och lägger in den i StageStats.'''
+
+    def __init__(self, stats, stage):
+        self.stats = stats;
+        self.stage = stage;
+
+    def __enter__(self):
+        self.start = time.perf_counter();
+        return self;
+
+    def __exit__(self, *exc):
+        self.stats.record(self.stage, time.perf_counter() - self.start);
+        return False;
+
+class StageStats:
+    '''
+    Samlar tider per steg i renderingen (decode, enhance, resize, map, write ...):
+    antal, total tid och percentiler över de senaste STATS_SAMPLES mätningarna.
+    Avstängd som standard; då returnerar time() en delad tom context manager.
+    '''
+
+    def __init__(self, max_samples=STATS_SAMPLES):
+        '''Skapa en tom, avstängd mätare.'''
+        self.enabled = False;
+        self.max_samples = max_samples;
+        self._stages = {};
+        self._lock = threading.Lock();
+
+    def enable(self):
+        '''Börja mäta.'''
+        self.enabled = True;
+
+    def disable(self):
+        '''Sluta mäta (insamlade värden finns kvar).'''
+        self.enabled = False;
+
+    def reset(self):
+        '''Nollställ alla steg.'''
+        with self._lock:
+            self._stages = {};
+
+    def time(self, stage):
+        '''Mät tiden för ett steg: "with STATS.time("resize"): ...".'''
+        if not self.enabled:
+            return _OFF;
+        return _Timer(self, stage);
+
+    def record(self, stage, seconds):
+        '''Lägg till en mätning för ett steg.'''
+        with self._lock:
+            st = self._stages.get(stage);
+            if st is None:
+                st = self._stages[stage] = {"count": 0, "total": 0.0, "samples": deque(maxlen=self.max_samples)};
+            st["count"] += 1;
+            st["total"] += seconds;
+            st["samples"].append(seconds);
+
+    def snapshot(self):
+        '''
+        Returnera en dict per steg med count, total, mean, p50, p95, p99 och max (sekunder).
+        Percentilerna gäller de senaste max_samples mätningarna.
+        '''
+        with self._lock:
+            stages = {k: (v["count"], v["total"], sorted(v["samples"])) for k, v in self._stages.items()};
+        out = {};
+        for stage, (count, total, samples) in stages.items():
+            pct = lambda p: samples[min(len(samples) - 1, int(p * len(samples)))];
+            out[stage] = {
+                "count": count,
+                "total": total,
+                "mean": total / count,
+                "p50": pct(0.50),
+                "p95": pct(0.95),
+                "p99": pct(0.99),
+                "max": samples[-1]
+            };
+        return out;
+
+    def lines(self):
+        '''Returnera snapshot() som textrader (tider i ms) för utskrift.'''
+        snap = self.snapshot();
+        if not snap:
+            return ["Inga mätningar." + ("" if self.enabled else " Slå på med 'stats on'.")];
+        lines = [f"{'steg':<10}{'antal':>8}{'total':>11}{'medel':>9}{'p50':>9}{'p95':>9}{'p99':>9}"];
+        for stage, s in sorted(snap.items(), key=lambda kv: -kv[1]["total"]):
+            lines.append(
+                f"{stage:<10}{s['count']:>8}{s['total'] * 1000:>11.2f}{s['mean'] * 1000:>9.2f}"
+                f"{s['p50'] * 1000:>9.2f}{s['p95'] * 1000:>9.2f}{s['p99'] * 1000:>9.2f}"
+            );
+        return lines;
+
+# Gemensam mätare för hela programmet
+STATS = StageStats();
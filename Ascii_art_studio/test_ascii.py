@@ -1,10 +1,29 @@
+import asyncio;
+import contextlib;
+import http.client;
+import io;
+import json;
 import os;
+import re;
 import tempfile;
+import threading;
+import time;
 import unittest;
-from PIL import Image;
-from constants import STRETCH;
+from unittest import mock;
+from PIL import Image, ImageEnhance, ImageFile;
+from constants import ASCII_CHARS, STRETCH;
 from asciiartimage import AsciiArtImage;
 from session import Session;
+from diskcache import DiskRenderCache;
+from pixelcache import PixelCache;
+from glyphs import GlyphCache;
+import animation;
+import bench;
+import charsets;
+import dithering;
+import main;
+import server;
+from stats import STATS;
 
 
 class TestAsciiArtStudio(unittest.TestCase):
@@ -47,6 +66,119 @@ class TestAsciiArtStudio(unittest.TestCase):
         lines = art.splitlines();
         self.assertEqual(len(lines), a.height);
 
+    def test_render_matches_reference_mapping(self):
+        # Gradient så att alla 256 gråvärden förekommer
+        path = os.path.join(self.tmpdir.name, "grad.png");
+        grad = Image.new("L", (256, 40));
+        grad.putdata([x for _ in range(40) for x in range(256)]);
+        grad.save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_width(256);
+        a.set_height(40);
+        img = a._enhanced_resized();
+        n = len(ASCII_CHARS) - 1;
+        chars = [ASCII_CHARS[(p * n) // 255] for p in img.tobytes()];
+        expected = '\n'.join(''.join(chars[i:i + a.width]) for i in range(0, len(chars), a.width));
+        self.assertEqual(a.render_to_string(), expected);
+
+    def test_render_cache_hits_and_rekey(self):
+        a = AsciiArtImage(self.img_path);
+        a.load();
+        first = a.render_to_string();
+        self.assertEqual(a.render_to_string(), first);
+        self.assertEqual((a.cache.hits, a.cache.misses), (1, 1));
+        a.set_width(30);
+        self.assertNotEqual(a.render_to_string(), first);
+        self.assertEqual(a.cache.misses, 2);
+
+    def test_session_render_cache_limit(self):
+        s = Session(cache_bytes=10 ** 6);
+        s.add_image(self.img_path, alias="a");
+        s.add_image(self.img_path, alias="b");
+        s.render("a");
+        s.render("b");
+        self.assertEqual(len(s.render_cache.entries), 2);
+        s.set_cache_limit(s.render_cache.bytes - 1);
+        self.assertEqual(len(s.render_cache.entries), 1);
+        self.assertLessEqual(s.render_cache.bytes, s.render_cache.max_bytes);
+
+    def test_fused_pipeline_tolerance(self):
+        path = os.path.join(self.tmpdir.name, "grad.png");
+        Image.linear_gradient("L").resize((640, 480)).rotate(30, fillcolor=200).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_brightness(1.2);
+        a.set_contrast(1.5);
+        # Utan resize ska tabellen ge exakt samma bild som ImageEnhance
+        ref = ImageEnhance.Contrast(ImageEnhance.Brightness(a.image).enhance(1.2)).enhance(1.5);
+        self.assertEqual(a.image.point(a._tone_table()).tobytes(), ref.tobytes());
+        a.set_width(80);
+        classic = a._enhanced_resized().tobytes();
+        a.set_pipeline("fused");
+        fused = a._enhanced_resized().tobytes();
+        diffs = [abs(p - q) for p, q in zip(classic, fused)];
+        self.assertLess(sum(diffs) / len(diffs), 2.0);
+        self.assertGreater(sum(1 for d in diffs if d <= 2) / len(diffs), 0.95);
+
+    def test_pyramid_level_selection(self):
+        path = os.path.join(self.tmpdir.name, "big.png");
+        Image.new("L", (800, 600), color=90).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        self.assertIn("pyramid: (ej byggd)", a.info_string());
+        a.set_width(50);
+        art = a.render_to_string();
+        self.assertEqual(len(art.splitlines()), a.height);
+        self.assertEqual([lv.size for lv in a._levels][1:], [(400, 300), (200, 150), (100, 75), (50, 38)]);
+        self.assertEqual(a._source_for((a.width, a.height)).size, (100, 75));
+        self.assertEqual(a._source_for((250, 10)).size, (800, 600));
+        self.assertIn("4 nivåer", a.info_string());
+
+    def test_pyramid_matches_full_resolution_resize(self):
+        # pyramiden ändrar standardutdata något jämfört med resize från full upplösning
+        path = os.path.join(self.tmpdir.name, "big.png");
+        Image.linear_gradient("L").resize((1600, 1200)).rotate(30, fillcolor=200).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        for width in (50, 120, 400, 1000):
+            a.set_width(width);
+            full = a.image.resize((a.width, a.height), resample=Image.BILINEAR).tobytes();
+            diffs = [abs(p - q) for p, q in zip(a._enhanced_resized().tobytes(), full)];
+            self.assertLessEqual(max(diffs), 4);
+            self.assertLess(sum(diffs) / len(diffs), 1.0);
+
+    def test_reduced_decode_and_redecode(self):
+        png = os.path.join(self.tmpdir.name, "big.png");
+        jpg = os.path.join(self.tmpdir.name, "big.jpg");
+        Image.linear_gradient("L").resize((800, 600)).save(png);
+        Image.linear_gradient("L").resize((800, 600)).save(jpg);
+        for path in (png, jpg):
+            a = AsciiArtImage(path);
+            a.load(reduced=True);
+            self.assertEqual(a.orig_size, (800, 600));
+            self.assertEqual(a.image.size, (100, 75));
+            self.assertEqual(len(a.render_to_string().splitlines()), a.height);
+            # större bredd än arbetskopian räcker till -> avkoda om från disk
+            a.set_width(300);
+            a.render_to_string();
+            self.assertEqual(a.image.size, (800, 600));
+
+    def test_session_lazy_decode_and_lru(self):
+        s = Session(max_decoded=1);
+        a = s.add_image(self.img_path, alias="a");
+        b = s.add_image(self.img_path, alias="b");
+        self.assertIsNone(a.image);
+        self.assertEqual(a.orig_size, (80, 60));
+        s.render("a");
+        self.assertIsNotNone(a.image);
+        b.set_width(20);
+        s.render("b");
+        # a har inte använts på längst, så dess pixlar släpps
+        self.assertIsNone(a.image);
+        self.assertIsNotNone(b.image);
+        self.assertEqual(len(s.render("a").splitlines()), a.height);
+
     def test_session_save_load_roundtrip(self):
         s1 = Session();
         img = s1.add_image(self.img_path, alias="test");
@@ -62,6 +194,565 @@ class TestAsciiArtStudio(unittest.TestCase):
         self.assertEqual(img2.width, 42);
         self.assertAlmostEqual(img2.brightness, 1.2, places=6);
 
+    def test_parallel_session_load_keeps_order(self):
+        names = [f"img{i}" for i in range(6)];
+        entries = [{"filename": self.img_path, "alias": n, "width": 10 + i} for i, n in enumerate(names)];
+        entries.insert(2, {"filename": os.path.join(self.tmpdir.name, "saknas.png"), "alias": "x"});
+        tmp_json = os.path.join(self.tmpdir.name, "sess.json");
+        with open(tmp_json, "w", encoding="utf-8") as f:
+            json.dump({"images": entries, "current": "img3"}, f);
+        s = Session(load_workers=4);
+        out = io.StringIO();
+        with contextlib.redirect_stdout(out):
+            s.load_session(tmp_json, preload=True);
+        self.assertIn("saknas.png", out.getvalue());
+        self.assertEqual(list(s.images), names);
+        self.assertEqual([img.width for img in s.images.values()], [10 + i for i in range(6)]);
+        self.assertIsNotNone(s.images["img0"].image);
+        self.assertEqual(s.current, "img3");
+
+    def test_render_all_collects_errors(self):
+        s = Session();
+        s.add_image(self.img_path, alias="a");
+        s.add_image(self.img_path, alias="b").set_width(20);
+        broken = os.path.join(self.tmpdir.name, "broken.png");
+        Image.new("L", (10, 10)).save(broken);
+        s.add_image(broken);
+        os.remove(broken);
+        out_dir = os.path.join(self.tmpdir.name, "out");
+        seen = [];
+        res = s.render_all(out_dir, workers=2, progress=lambda done, total, name, err: seen.append(done));
+        self.assertEqual(res["rendered"], 2);
+        self.assertEqual([key for key, _ in res["errors"]], [broken]);
+        self.assertEqual(sorted(seen), [1, 2, 3]);
+        with open(os.path.join(out_dir, "b.txt"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), s.render("b") + "\n");
+        self.assertEqual(res["chars"], sum(img.width * img.height for img in (s.images["a"], s.images["b"])));
+
+    def test_oneshot_render_and_script_exit_codes(self):
+        out = os.path.join(self.tmpdir.name, "Ut.txt");
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(main.main(["render", self.img_path, "--width", "20", "-o", out]), 0);
+            self.assertEqual(main.main(["render", os.path.join(self.tmpdir.name, "saknas.png")]), 1);
+        ref = AsciiArtImage(self.img_path);
+        ref.load();
+        ref.set_width(20);
+        with open(out, encoding="utf-8") as f:
+            self.assertEqual(f.read(), ref.render_to_string() + "\n");
+        script = [f"load image {self.img_path} as Bild", "# kommentar", "set Bild width 12", "render Bild"];
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(main.run_script(Session(), script), 0);
+            self.assertEqual(main.run_script(Session(), script + ["set Bild width -1"]), 1);
+        # citattecken håller ihop en teckenuppsättning med mellanslag, "# kommentar" är inget specialfall
+        sess = Session();
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(main.run_script(sess, script[:1] + ['set Bild charset " .:#"']), 0);
+            self.assertEqual(main.run_script(sess, ['set Bild charset " .:']), 1);
+        self.assertEqual(sess.images["Bild"].charset, " .:#");
+
+    def test_streamed_lines_match_string_render(self):
+        s = Session();
+        img = s.add_image(self.img_path, alias="a");
+        img.set_width(33);
+        img.set_contrast(1.4);
+        out = os.path.join(self.tmpdir.name, "stream.txt");
+        s.render_to_file("a", out);
+        expected = img._render();
+        self.assertEqual(list(img.iter_lines()), expected.split("\n"));
+        with open(out, encoding="utf-8") as f:
+            self.assertEqual(f.read(), expected + "\n");
+        # andra gången kommer renderingen från cachen och ska se likadan ut
+        buf = io.BytesIO();
+        s.render("a");
+        self.assertEqual(s.write_render("a", buf), len(expected) - expected.count("\n"));
+        self.assertEqual(buf.getvalue().decode("utf-8"), expected + "\n");
+        # antalet är tecken, inte byte: färgkoder och flerbytetecken räknas som de syns
+        for mode in ("color", "half", "braille"):
+            img.set_mode(mode);
+            for _ in range(2):
+                self.assertEqual(s.write_render("a", io.BytesIO()), img.width * img.height);
+
+    def test_streamed_render_fills_cache(self):
+        s = Session();
+        img = s.add_image(self.img_path, alias="a");
+        out = os.path.join(self.tmpdir.name, "ut.txt");
+        with mock.patch.object(img, "_iter_row_bytes", wraps=img._iter_row_bytes) as rows, \
+                mock.patch.object(img, "_render", wraps=img._render) as whole:
+            s.render_to_file("a", out);
+            s.render("a");
+            self.assertEqual(s.render_cache.hits, 1);
+            s.render_to_file("a", out);
+            self.assertEqual(s.render_cache.hits, 2);
+            self.assertEqual(rows.call_count + whole.call_count, 1);
+        with open(out, encoding="utf-8") as f:
+            self.assertEqual(f.read(), img.render_to_string() + "\n");
+        # åt andra hållet: render följt av export renderar också bara en gång
+        s = Session();
+        img = s.add_image(self.img_path, alias="a");
+        with mock.patch.object(img, "_render", wraps=img._render) as whole:
+            s.render("a");
+            s.render_to_file("a", out);
+        self.assertEqual((s.render_cache.hits, whole.call_count), (1, 1));
+
+    def test_render_gif_frames(self):
+        gif = os.path.join(self.tmpdir.name, "anim.gif");
+        frames = [Image.new("L", (80, 60), color=c) for c in (0, 128, 255)];
+        frames[0].save(gif, save_all=True, append_images=frames[1:], duration=50);
+        s = Session();
+        s.add_image(gif, alias="anim").set_width(16);
+        single = os.path.join(self.tmpdir.name, "anim.txt");
+        res = s.render_frames("anim", single);
+        self.assertEqual(res["frames"], 3);
+        with open(single, encoding="utf-8") as f:
+            parts = f.read().split("\f\n");
+        self.assertEqual(len(parts), 3);
+        self.assertEqual(parts[0].splitlines()[0], "@" * 16);
+        self.assertEqual(parts[2].splitlines()[0], " " * 16);
+        split_dir = os.path.join(self.tmpdir.name, "frames") + os.sep;
+        s.render_frames("anim", split_dir);
+        self.assertEqual(sorted(os.listdir(split_dir)), ["frame_00001.txt", "frame_00002.txt", "frame_00003.txt"]);
+        # andra lägen än ascii ger ett fel istället för tyst vanlig ASCII, och ingen fil skapas
+        s.images["anim"].set_mode("color");
+        other = os.path.join(self.tmpdir.name, "color.txt");
+        with self.assertRaises(ValueError):
+            s.render_frames("anim", other);
+        self.assertFalse(os.path.exists(other));
+        with self.assertRaises(ValueError):
+            animation.play(s.images["anim"], out=io.BytesIO());
+
+    def test_diff_rows_sends_only_changed_spans(self):
+        prev = [b"@@@@@@", b"......"];
+        rows = [b"@@##@@", b"......"];
+        self.assertEqual(animation.diff_rows(prev, rows), b"\x1b[1;3H##");
+        self.assertEqual(animation.diff_rows(rows, rows), b"");
+        self.assertEqual(animation.diff_rows(None, rows), b"\x1b[1;1H@@##@@\x1b[2;1H......");
+
+    def test_play_drops_late_frames(self):
+        a = AsciiArtImage(self.img_path);
+        a.load();
+        a.set_width(10);
+        frames = [Image.new("L", (80, 60), color=c) for c in (0, 0, 255, 255, 0)];
+        # klockan hoppar 0.25 s per anrop, så vid 10 fps hamnar vi efter
+        ticks = iter(i * 0.25 for i in range(100));
+        out = io.BytesIO();
+        res = animation.play(a, frames, fps=10, out=out, clock=lambda: next(ticks), sleep=lambda s: None);
+        self.assertEqual(res["shown"] + res["dropped"], 5);
+        self.assertGreater(res["dropped"], 0);
+        self.assertEqual(res["bytes"], len(out.getvalue()) - len(b"\x1b[2J\x1b[?25l") - len(b"\x1b[%d;1H\x1b[?25h" % (a.height + 1)));
+        # rutor från en katalog: bara de som visas avkodas, och källbilden behöver bara filhuvudet
+        paths = [];
+        for i, c in enumerate((0, 0, 255, 255, 0)):
+            paths.append(os.path.join(self.tmpdir.name, f"frame{i}.png"));
+            Image.new("L", (80, 60), color=c).save(paths[-1]);
+        b = AsciiArtImage(paths[0]);
+        b.load_header();
+        b.set_width(10);
+        b.set_contrast(1.3);
+        decoded = {};
+        load = ImageFile.ImageFile.load;
+
+        def counting_load(im):
+            # convert anropar load mer än en gång, så bilderna räknas och inte anropen
+            decoded[id(im)] = im;
+            return load(im);
+
+        # ruta 0 och 4 hinns med, 1-3 är för sena
+        ticks = iter([0, 0, 0.5, 0.5, 0.5, 0.5, 0.6]);
+        with mock.patch.object(ImageFile.ImageFile, "load", counting_load):
+            res = animation.play(b, animation.dir_frames(paths), fps=10, out=io.BytesIO(),
+                                 clock=lambda: next(ticks), sleep=lambda s: None);
+        self.assertEqual((res["shown"], res["dropped"]), (2, 3));
+        # en avkodning för källans histogram (kontrasten), sedan en per visad ruta
+        self.assertEqual(len(decoded), 1 + res["shown"]);
+        self.assertIsNone(b.image);
+        self.assertEqual(sum(b._histogram), 80 * 60);
+
+    def test_color_mode_merges_runs(self):
+        path = os.path.join(self.tmpdir.name, "rgb.png");
+        img = Image.new("RGB", (80, 60), (200, 30, 30));
+        img.paste((30, 30, 200), (40, 0, 80, 60));
+        img.save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        # full bredd, så att inga blandfärger uppstår i skarven vid resize
+        a.set_width(80);
+        plain = a.render_to_string();
+        a.set_mode("color");
+        colored = a.render_to_string();
+        self.assertEqual(re.sub(r"\x1b\[[0-9;]*m", "", colored), plain);
+        for line in colored.splitlines():
+            # två färgfält per rad -> två färgkoder plus återställning
+            self.assertEqual(line.count("\x1b[38;2;"), 2);
+            self.assertTrue(line.endswith("\x1b[0m"));
+
+    def test_bench_compare_flags_regressions(self):
+        base = {"results": [bench.record("pipeline", "render", (640, 480), 80, 0.010, 640 * 480, 0),
+                            bench.record("pipeline", "load", (640, 480), None, 0.020, 640 * 480, 0)]};
+        cur = {"results": [bench.record("pipeline", "render", (640, 480), 80, 0.013, 640 * 480, 0),
+                           bench.record("pipeline", "load", (640, 480), None, 0.021, 640 * 480, 0)]};
+        regressions = bench.compare(cur, base, 0.2);
+        self.assertEqual(len(regressions), 1);
+        self.assertEqual(regressions[0][0]["stage"], "render");
+        self.assertAlmostEqual(regressions[0][3], 0.3);
+
+    def test_stage_stats(self):
+        s = Session();
+        s.add_image(self.img_path, alias="a").set_brightness(1.3);
+        STATS.reset();
+        s.render("a");
+        self.assertEqual(s.stats()["cache"]["misses"], 1);
+        self.assertNotIn("resize", s.stats());
+        STATS.enable();
+        try:
+            s.images["a"].set_width(21);
+            s.render("a");
+            s.render_to_file("a", os.path.join(self.tmpdir.name, "ut.txt"));
+        finally:
+            STATS.disable();
+        snap = s.stats();
+        for stage in ("enhance", "resize", "map", "render", "write"):
+            self.assertIn(stage, snap);
+        self.assertEqual(snap["render"]["count"], 1);
+        self.assertLessEqual(snap["resize"]["p50"], snap["resize"]["max"]);
+
+    def test_disk_cache_across_instances(self):
+        cache_dir = os.path.join(self.tmpdir.name, "cache");
+        a = AsciiArtImage(self.img_path);
+        a.disk_cache = DiskRenderCache(cache_dir);
+        a.load_header();
+        art = a.render_to_string();
+        # ny instans ("ny process"): träff på disk utan att pixlarna avkodas
+        b = AsciiArtImage(self.img_path);
+        b.disk_cache = DiskRenderCache(cache_dir);
+        b.load_header();
+        self.assertEqual(b.render_to_string(), art);
+        self.assertIsNone(b.image);
+        # ändrat innehåll ger ny nyckel
+        Image.new("L", (80, 60), color=10).save(self.img_path);
+        os.utime(self.img_path, ns=(1, 1));
+        b.load_header();
+        self.assertNotEqual(b.render_to_string(), art);
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        cache = DiskRenderCache(os.path.join(self.tmpdir.name, "cache"), max_bytes=250);
+        for i, key in enumerate(("a", "b", "c")):
+            cache.put(key, "x" * 100);
+            os.utime(cache._path(key), ns=(i * 10 ** 9, i * 10 ** 9));
+        self.assertIsNone(cache.get("a"));
+        self.assertEqual(cache.get("c"), "x" * 100);
+
+    def test_pixel_cache_memory_maps_and_invalidates(self):
+        cache = PixelCache(os.path.join(self.tmpdir.name, "pixels"));
+        a = AsciiArtImage(self.img_path);
+        a.pixel_cache = cache;
+        a.load();
+        art = a.render_to_string();
+        b = AsciiArtImage(self.img_path);
+        b.pixel_cache = cache;
+        b.load();
+        # pixlarna kommer från den minnesmappade filen, inte från avkodaren
+        self.assertTrue(b.image.readonly);
+        self.assertEqual(b.image.tobytes(), a.image.tobytes());
+        self.assertEqual(b.render_to_string(), art);
+        Image.new("L", (80, 60), color=0).save(self.img_path);
+        os.utime(self.img_path, ns=(1, 1));
+        b.load();
+        self.assertFalse(b.image.readonly);
+        self.assertEqual(set(b.image.tobytes()), {0});
+
+    def test_tiled_render_matches_full_render(self):
+        # BMP lagras nerifrån och upp och läses rad för rad i remsor
+        path = os.path.join(self.tmpdir.name, "big.bmp");
+        Image.linear_gradient("L").resize((1200, 1000)).rotate(30, fillcolor=200).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_width(150);
+        a.set_brightness(1.1);
+        a.set_contrast(1.3);
+        a.set_pipeline("fused");
+        full = a.render_to_string();
+        b = AsciiArtImage(path);
+        b.load_header();
+        b.set_width(150);
+        b.set_brightness(1.1);
+        b.set_contrast(1.3);
+        b.set_tiled("on");
+        tiled = b.render_to_string();
+        self.assertIsNone(b.image);
+        self.assertEqual(len(tiled.splitlines()), b.height);
+        # full rendering går via pyramiden, så enstaka tecken kan skilja ett steg
+        pairs = [(ASCII_CHARS.index(p), ASCII_CHARS.index(q))
+                 for p, q in zip(full.replace("\n", ""), tiled.replace("\n", ""))];
+        self.assertGreater(sum(1 for p, q in pairs if abs(p - q) <= 1) / len(pairs), 0.99);
+
+    def test_sharded_render_is_identical(self):
+        path = os.path.join(self.tmpdir.name, "grad.png");
+        Image.linear_gradient("L").resize((640, 480)).rotate(30, fillcolor=200).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_width(120);
+        a.set_brightness(1.2);
+        a.set_contrast(1.4);
+        single = a._render();
+        a.set_shards(3);
+        self.assertEqual(a._render(), single);
+        buf = io.BytesIO();
+        a.write_to(buf);
+        self.assertEqual(buf.getvalue().decode("ascii"), single + "\n");
+        with self.assertRaises(ValueError):
+            a.set_shards(0);
+        # classic med kontrast från en förminskad pyramidnivå: samma medelvärde i båda vägarna
+        big = os.path.join(self.tmpdir.name, "noisy.png");
+        Image.blend(Image.linear_gradient("L").resize((1600, 1200)).rotate(30, fillcolor=200),
+                    Image.effect_noise((1600, 1200), 60), 0.4).save(big);
+        b = AsciiArtImage(big);
+        b.load();
+        b.set_brightness(1.2);
+        b.set_contrast(1.5);
+        for width in (40, 80):
+            b.set_width(width);
+            b.set_shards(1);
+            self.assertLess(b._source_for((b.width, b.height)).width, 1600);
+            single = b.render_to_string();
+            key = b._render_key();
+            b.set_shards(3);
+            # uppdelningen har egen cachepost
+            self.assertNotEqual(b._render_key(), key);
+            self.assertEqual(b.render_to_string(), single);
+
+    def _start_server(self, srv):
+        # servern körs i en egen tråd med egen event-loop, testet pratar HTTP mot localhost
+        loop = asyncio.new_event_loop();
+        thread = threading.Thread(target=loop.run_forever, daemon=True);
+        thread.start();
+        asyncio.run_coroutine_threadsafe(srv.start(), loop).result();
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(srv.close(), loop).result();
+            loop.call_soon_threadsafe(loop.stop);
+            thread.join();
+            loop.close();
+        self.addCleanup(stop);
+
+        def request(method, url, body=None):
+            conn = http.client.HTTPConnection("127.0.0.1", srv.port, timeout=10);
+            conn.request(method, url, body=body);
+            resp = conn.getresponse();
+            data = resp.read();
+            conn.close();
+            return resp.status, data;
+        return request;
+
+    def test_server_renders_paths_and_uploads(self):
+        srv = server.RenderServer(root=self.tmpdir.name);
+        request = self._start_server(srv);
+        ref = AsciiArtImage(self.img_path);
+        ref.load();
+        ref.set_width(30);
+        ref.set_brightness(1.5);
+        expected = (ref.render_to_string() + "\n").encode("ascii");
+        self.assertEqual(request("GET", "/render?path=test.png&width=30&brightness=1.5"), (200, expected));
+        self.assertEqual(request("GET", "/render?path=test.png&width=30&brightness=1.5"), (200, expected));
+        with open(self.img_path, "rb") as f:
+            self.assertEqual(request("POST", "/render?width=30&brightness=1.5", f.read()), (200, expected));
+        self.assertEqual(request("GET", "/render?path=../x.png")[0], 403);
+        self.assertEqual(request("GET", "/render?path=saknas.png")[0], 404);
+        self.assertEqual(request("GET", "/render?path=test.png&width=-1")[0], 400);
+        self.assertEqual(request("GET", f"/render?path=test.png&width={server.SERVER_MAX_WIDTH + 1}")[0], 400);
+        self.assertEqual(request("GET", f"/render?path=test.png&height={server.SERVER_MAX_HEIGHT + 1}")[0], 400);
+        # den delade bilden i sessionen har inte fått förfrågningarnas inställningar
+        self.assertEqual(srv.session.images[os.path.realpath(self.img_path)].brightness, 1.0);
+        status, data = request("GET", "/metrics");
+        metrics = json.loads(data);
+        self.assertEqual(metrics["responses"]["200"], 3);
+        self.assertEqual(metrics["cache"]["hits"], 1);
+        self.assertEqual(metrics["latency"]["render"]["count"], 8);
+        self.assertEqual(metrics["queue_depth"], 0);
+        # färgläget sätts på förfrågans kopia via set_mode, inte på den delade bilden
+        self.assertEqual(request("GET", "/render?path=test.png&mode=color&width=10")[0], 200);
+        self.assertEqual(srv.session.images[os.path.realpath(self.img_path)].mode, "ascii");
+        self.assertEqual(request("GET", "/render?path=test.png&mode=plaid")[0], 400);
+        # fler bilder än max_images: den som använts längst sedan (uppladdningen) tas bort
+        srv.max_images = 2;
+        Image.new("L", (20, 20), 50).save(os.path.join(self.tmpdir.name, "other.png"));
+        self.assertEqual(request("GET", "/render?path=other.png")[0], 200);
+        self.assertEqual(len(srv.session.images), 2);
+        self.assertFalse(any(k.startswith("upload:") for k in srv.session.images));
+        self.assertEqual(os.listdir(srv.upload_dir), []);
+        # en uppladdning som inte är en bild ger 400 utan sökväg och lämnar ingen fil kvar
+        status, data = request("POST", "/render", b"ingen bild");
+        self.assertEqual(status, 400);
+        self.assertNotIn(srv.upload_dir.encode("utf-8"), data);
+        self.assertEqual(os.listdir(srv.upload_dir), []);
+
+    def test_server_rejects_when_busy(self):
+        release = threading.Event();
+
+        class SlowServer(server.RenderServer):
+            def _run(self, query, upload):
+                release.wait(10);
+                return super()._run(query, upload);
+
+        srv = SlowServer(workers=1, queue=0, root=self.tmpdir.name);
+        request = self._start_server(srv);
+        results = [];
+        first = threading.Thread(target=lambda: results.append(request("GET", "/render?path=test.png")));
+        first.start();
+        deadline = time.monotonic() + 10;
+        while srv.in_flight == 0 and time.monotonic() < deadline:
+            time.sleep(0.01);
+        self.assertEqual(request("GET", "/render?path=test.png")[0], 503);
+        release.set();
+        first.join();
+        self.assertEqual(results[0][0], 200);
+
+    def test_half_and_braille_pack_dots(self):
+        # 8x16 punkter med slumpmässigt mönster: braille 4x4 tecken, halvblock 8x8 tecken
+        path = os.path.join(self.tmpdir.name, "dots.png");
+        bits = [[(x * 7 + y * 13 + x * y) % 3 == 0 for x in range(8)] for y in range(16)];
+        Image.frombytes("L", (8, 16), bytes(0 if b else 255 for row in bits for b in row)).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_mode("braille");
+        a.set_width(4);
+        self.assertEqual(a.height, 4);
+        weights = [[0x01, 0x08], [0x02, 0x10], [0x04, 0x20], [0x40, 0x80]];
+        expected = "\n".join(
+            "".join(chr(0x2800 + sum(weights[dy][dx] for dy in range(4) for dx in range(2) if bits[4 * r + dy][2 * c + dx]))
+                    for c in range(4)) for r in range(4));
+        self.assertEqual(a.render_to_string(), expected);
+        a.set_mode("half");
+        a.set_width(8);
+        self.assertEqual(a.height, 8);
+        blocks = {(False, False): " ", (True, False): "\u2580", (False, True): "\u2584", (True, True): "\u2588"};
+        expected = "\n".join("".join(blocks[bits[2 * r][c], bits[2 * r + 1][c]] for c in range(8)) for r in range(8));
+        self.assertEqual(a.render_to_string(), expected);
+        # reducerad avkodning behåller tillräckligt många punkter per tecken
+        self.assertEqual(a._decode_limit(), (16, 32));
+
+    def test_glyph_index_matches_and_is_cached_on_disk(self):
+        directory = os.path.join(self.tmpdir.name, "glyphs");
+        index = GlyphCache(directory).index();
+        self.assertEqual(len(os.listdir(directory)), 1);
+        # varje glyf ligger närmast sig själv
+        codes = index.match(index.matrix / index.scale);
+        self.assertEqual("".join(map(chr, codes)), index.chars);
+        again = GlyphCache(directory).index();
+        self.assertTrue((again.matrix == index.matrix).all());
+        a = AsciiArtImage(self.img_path);
+        a.glyph_cache = GlyphCache(directory);
+        a.load();
+        a.set_mode("glyph");
+        a.set_width(20);
+        self.assertEqual(a._decode_limit(), (160, 128));
+        lines = a.render_to_string().splitlines();
+        self.assertEqual(len(lines), a.height);
+        self.assertTrue(all(len(line) == 20 for line in lines));
+        # en jämn grå yta blir ett och samma tecken överallt
+        self.assertEqual(len(set("".join(lines))), 1);
+
+    def test_charsets_rank_share_tables_and_roundtrip(self):
+        self.assertEqual(charsets.CHARSETS["standard"], ASCII_CHARS);
+        # egna tecken rangordnas efter bläck: mest bläck först, mellanslag sist
+        self.assertEqual(charsets.resolve(" .@"), "@. ");
+        with self.assertRaises(ValueError):
+            charsets.resolve("x");
+        a = AsciiArtImage(self.img_path);
+        a.load();
+        b = AsciiArtImage(self.img_path);
+        b.load();
+        standard = a.render_to_string();
+        a.set_charset("blocks");
+        b.set_charset("blocks");
+        self.assertIs(charsets.get(a.chars), charsets.get(b.chars));
+        # mellangrått (128) hamnar på ett av blocken i mitten
+        art = a.render_to_string();
+        self.assertEqual(set(art.replace("\n", "")), {"\u2592"});
+        self.assertNotEqual(art, standard);
+        buf = io.BytesIO();
+        a.write_to(buf);
+        self.assertEqual(buf.getvalue().decode("utf-8"), art + "\n");
+        c = AsciiArtImage.from_dict(json.loads(json.dumps(a.to_dict())));
+        self.assertEqual((c.charset, c.chars), ("blocks", a.chars));
+        self.assertEqual(c.render_to_string(), art);
+
+    def test_dithering_breaks_up_banding(self):
+        path = os.path.join(self.tmpdir.name, "ramp.png");
+        Image.linear_gradient("L").rotate(90).resize((400, 100)).save(path);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_width(400);
+        plain = a.render_to_string();
+        levels = len(ASCII_CHARS) - 1;
+        for method in ("ordered", "fs"):
+            a.set_dither(method);
+            art = a.render_to_string();
+            self.assertNotEqual(art, plain);
+            # medelljusheten per kolumnblock bevaras ungefär, trots att varje pixel blir en nivå
+            img = a._enhanced_resized();
+            out = dithering.apply(img, levels, method);
+            self.assertLessEqual(set(out.tobytes()), set(dithering.level_grays(levels).tolist()));
+            self.assertLess(abs(sum(out.tobytes()) / len(out.tobytes()) - sum(img.tobytes()) / len(img.tobytes())), 2.0);
+        # ordered fortsätter mönstret i band: ett band från rad 3 blir som raderna 3.. i hela bilden
+        band = dithering.ordered(img.crop((0, 3, 400, a.height)), levels, 3);
+        self.assertEqual(band.tobytes(), dithering.ordered(img, levels).tobytes()[3 * 400:]);
+        with self.assertRaises(ValueError):
+            a.set_dither("random");
+
+    def test_viewport_zoom_and_pan(self):
+        path = os.path.join(self.tmpdir.name, "view.png");
+        Image.linear_gradient("L").resize((800, 600)).rotate(30, fillcolor=200).save(path);
+        crop = os.path.join(self.tmpdir.name, "crop.png");
+        Image.open(path).crop((200, 150, 600, 450)).save(crop);
+        a = AsciiArtImage(path);
+        a.load();
+        a.set_width(80);
+        whole = a.render_to_string();
+        a.set_viewport(2);
+        # utsnittet ska se ut som den utklippta bilden renderad i samma storlek
+        c = AsciiArtImage(crop);
+        c.load();
+        c.set_width(80);
+        self.assertEqual((a.width, a.height), (c.width, c.height));
+        diff = [abs(p - q) for p, q in zip(a._enhanced_resized().tobytes(), c._enhanced_resized().tobytes())];
+        self.assertLessEqual(max(diff), 1);
+        self.assertNotEqual(a.render_to_string(), whole);
+        # pan stannar vid kanten, reset visar hela bilden igen
+        a.pan(-5, 0);
+        self.assertEqual(a.center, (0.25, 0.5));
+        self.assertEqual(a._view_box(), (0.0, 150.0, 400.0, 450.0));
+        a.reset_viewport();
+        self.assertEqual(a.render_to_string(), whole);
+        with self.assertRaises(ValueError):
+            a.set_viewport(0.5);
+        # NaN och oändligt avvisas och lämnar utsnittet orört
+        for bad in ({"zoom": "nan"}, {"zoom": float("inf")}, {"center": (float("nan"), 0.5)}, {"center": (0.5, "inf")}):
+            with self.assertRaises(ValueError):
+                a.set_viewport(**bad);
+        for dx, dy in ((float("nan"), 0), (0, float("-inf"))):
+            with self.assertRaises(ValueError):
+                a.pan(dx, dy);
+        self.assertEqual((a.zoom, a.center), (1.0, (0.5, 0.5)));
+        # arbetet per zoom/pan beror på terminalens storlek, inte bildens
+        regions = [];
+        for size in (1000, 4000):
+            big = os.path.join(self.tmpdir.name, f"big{size}.png");
+            Image.linear_gradient("L").resize((size, size)).save(big);
+            b = AsciiArtImage(big);
+            b.load();
+            b.set_width(100);
+            b.set_viewport(4, (0.3, 0.7));
+            region, _ = b._view_crop(b._source_for(b._view_need((b.width, b.height))), (b.width, b.height));
+            regions.append(region.size);
+        self.assertEqual(regions[0], regions[1]);
+        c = AsciiArtImage.from_dict(json.loads(json.dumps(b.to_dict())));
+        self.assertEqual((c.zoom, c.center), (4.0, (0.3, 0.7)));
+        sess = Session();
+        sess.add_image(path, "v");
+        self.assertTrue(main.run_command(sess, ["zoom", "v", "in"]));
+        self.assertTrue(main.run_command(sess, ["pan", "v", "right"]));
+        self.assertEqual((sess.images["v"].zoom, sess.images["v"].center), (2.0, (0.625, 0.5)));
+        self.assertFalse(main.run_command(sess, ["pan", "v", "x", "y"]));
 
 if __name__ == "__main__":
     unittest.main(verbosity=2);
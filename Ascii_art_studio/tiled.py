@@ -0,0 +1,181 @@
+import math;
+import threading;
+from PIL import Image;
+from constants import TILE_ROWS;
+import charsets;
+
+# Byte per pixel för råformat där filen inte anger radlängden själv
+_RAW_BYTES = {"1": None, "L": 1, "P": 1, "RGB": 3, "BGR": 3, "RGBA": 4, "RGBX": 4, "BGRX": 4, "CMYK": 4};
+
+# Pillows skydd mot dekompressionsbomber är globalt, så det lyfts under ett lås
+_OPEN_LOCK = threading.Lock();
+
+def open_unchecked(filename):
+    '''Öppna en bild utan Pillows storleksgräns (pixlarna läses ändå bara i remsor).'''
+    with _OPEN_LOCK:
+        old = Image.MAX_IMAGE_PIXELS;
+        Image.MAX_IMAGE_PIXELS = None;
+        try:
+            return Image.open(filename);
+        finally:
+            Image.MAX_IMAGE_PIXELS = old;
+
+def _raw_layout(im):
+    '''
+    Om bildens pixlar ligger okomprimerade rad för rad i filen (PGM/PPM, BMP,
+    okomprimerad TIFF ...), returnera (offset, radlängd, orientering, rawmode).
+    Annars None. Läser bara im.tile, som i alla Pillow-versioner är en lista
+    med fyrtupler (kodek, utsträckning, offset, argument).
+    '''
+    if len(im.tile) != 1 or im.mode not in _RAW_BYTES:
+        return None;
+    codec, extents, offset, args = tuple(im.tile[0]);
+    if codec != "raw" or tuple(extents) != (0, 0) + im.size:
+        return None;
+    if isinstance(args, str):
+        args = (args,);
+    rawmode, stride, orientation = (tuple(args) + (0, 1))[:3];
+    if not stride:
+        bpp = _RAW_BYTES.get(rawmode);
+        if not bpp:
+            return None;
+        stride = im.width * bpp;
+    if orientation not in (1, -1):
+        return None;
+    return offset, stride, orientation, rawmode;
+
+class StripReader:
+    '''
+    Läser horisontella remsor av en bild som gråskala.
+
+    För okomprimerade format läses bara remsans byte ur filen och avkodas
+    med Image.frombytes, så bara remsan finns i minnet. Andra format (PNG,
+    JPEG ...) kan inte läsas radvis med Pillows publika API; där avkodas
+    bilden en gång (JPEG med draft så nära målstorleken som möjligt) och
+    remsorna klipps ut ur den, så minnet följer bildens storlek.
+    '''
+
+    def __init__(self, filename, min_size=None):
+        self.filename = filename;
+        try:
+            im = Image.open(filename);
+        except Image.DecompressionBombError:
+            im = open_unchecked(filename);
+            if _raw_layout(im) is None:
+                im.close();
+                raise;
+        with im:
+            self.size = im.size;
+            self.mode = im.mode;
+            self.layout = _raw_layout(im);
+            self.palette = im.getpalette() if im.mode == "P" else None;
+            self.full = None;
+            if self.layout is None:
+                if min_size and im.format == "JPEG":
+                    im.draft("L", min_size);
+                self.full = im.convert("L");
+        # draft kan ha krympt bilden; remsorna anges i originalets koordinater
+        self.scale = self.full.height / self.size[1] if self.full else 1.0;
+
+    def read(self, y0, y1):
+        '''Returnera rader y0..y1 (exklusive) som en gråskalebild med full bredd.'''
+        if self.full is not None:
+            fy0 = int(y0 * self.scale);
+            fy1 = max(fy0 + 1, int(math.ceil(y1 * self.scale)));
+            return self.full.crop((0, fy0, self.full.width, fy1));
+        offset, stride, orientation, rawmode = self.layout;
+        w, h = self.size;
+        # bottom-up-filer (BMP) har sista raden först
+        start = y0 if orientation == 1 else h - y1;
+        with open(self.filename, "rb") as f:
+            f.seek(offset + start * stride);
+            data = f.read((y1 - y0) * stride);
+        strip = Image.frombytes(self.mode, (w, y1 - y0), data, "raw", rawmode, stride, orientation);
+        if self.palette is not None:
+            strip.putpalette(self.palette);
+        return strip.convert("L");
+
+def _histogram(reader):
+    '''Gråskalehistogram för hela bilden, summerat remsa för remsa.'''
+    hist = [0] * 256;
+    for y0 in range(0, reader.size[1], TILE_ROWS):
+        for i, n in enumerate(reader.read(y0, min(reader.size[1], y0 + TILE_ROWS)).histogram()):
+            hist[i] += n;
+    return hist;
+
+def histogram(filename, min_size=None):
+    '''
+    Gråskalehistogram för en bildfil utan att hela bilden avkodas på en gång
+    (okomprimerade format läses i remsor, JPEG med draft mot min_size).
+    '''
+    return _histogram(StripReader(filename, min_size));
+
+def _bands(art, reader):
+    '''
+    Generera (r0, r1, y0, y1, box) för varje band av utdatarader: vilka
+    källrader som ska läsas (med marginal för filtrets räckvidd) och vilken
+    del av remsan som motsvarar bandet.
+    '''
+    w, h = reader.size;
+    H = art.height;
+    view = art._view_box(reader.size);
+    span = h if view is None else view[3] - view[1];
+    rows = max(1, int(TILE_ROWS * H / span));
+    for r0 in range(0, H, rows):
+        r1 = min(H, r0 + rows);
+        yield (r0, r1) + band_rows(w, h, H, r0, r1, view);
+
+def band_rows(w, h, H, r0, r1, view=None):
+    '''
+    Vilka källrader (y0, y1) som behövs för utdataraderna r0..r1 när en
+    bild med höjd h (eller utsnittet view = (x0, y0, x1, y1) av den) skalas
+    till höjd H, och vilken box i den utklippta remsan som ger exakt samma
+    resultat som en resize av hela bilden.
+    '''
+    vx0, top, vx1, bottom = view or (0, 0, w, h);
+    scale = (bottom - top) / H;
+    # bilinjärt filter vid nedskalning når ungefär en skalfaktor åt varje håll
+    margin = int(math.ceil(scale)) + 1;
+    sy0, sy1 = top + r0 * scale, top + r1 * scale;
+    y0 = max(0, int(sy0) - margin);
+    y1 = min(h, int(math.ceil(sy1)) + margin);
+    return y0, y1, (vx0, sy0 - y0, vx1, sy1 - y0);
+
+def _strip_box(reader, y0, box):
+    '''Räkna om box till remsans koordinater om remsan kommer från en draft-nedskalad bild.'''
+    if reader.full is None:
+        return box;
+    s = reader.scale;
+    fy0 = int(y0 * s);
+    return (box[0] * s, (box[1] + y0) * s - fy0, box[2] * s, (box[3] + y0) * s - fy0);
+
+def iter_tiled_rows(art):
+    '''
+    Generera teckenraderna (UTF-8-bytes) för art utan att hela källbilden finns i minnet.
+
+    Källan läses i horisontella remsor på ungefär TILE_ROWS rader. Varje remsa
+    skalas till sin andel av utdataraderna, med några extra rader runt om så
+    att resultatet blir som vid en resize av hela bilden. Ljus/kontrast läggs
+    på efter resize (som pipeline "fused"); kontrastens medelvärde kräver ett
+    extra varv genom remsorna för histogrammet. Dithering görs per band;
+    med fs förs felet inte över bandgränserna.
+    '''
+    if art.orig_size is None:
+        raise RuntimeError("Ingen bild laddad");
+    W, H = art.width, art.height;
+    # vid zoom räcker den nedskalade bilden bara om utsnittet får sin upplösning
+    reader = StripReader(art.filename, art._view_need((W, H)));
+    tone = None;
+    if art.brightness != 1.0 or art.contrast != 1.0:
+        if art.contrast != 1.0 and art._histogram is None:
+            art._histogram = _histogram(reader);
+        tone = art._tone_table();
+    charset = charsets.get(art.chars);
+    for r0, r1, y0, y1, box in _bands(art, reader):
+        strip = reader.read(y0, y1);
+        img = strip.resize((W, r1 - r0), resample=Image.BILINEAR, box=_strip_box(reader, y0, box));
+        del strip;
+        if tone:
+            img = img.point(tone);
+        img = art._dithered(img, y0=r0);
+        yield from charset.rows(img.tobytes(), W);